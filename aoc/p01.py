@@ -2,15 +2,16 @@
 Code for https://adventofcode.com/2021/day/1
 """
 
+import io
 import os
-from typing import Sequence
+import tempfile
+from typing import Iterable, Iterator, Sequence, TextIO
 
 import numpy as np
+import numpy.typing as npt
 
-# NOTE: In Numpy 1.22.x, we will be able to use numpy.typing.ArrayLike.
 
-
-def count_increases(data: Sequence[int]) -> int:
+def count_increases(data: npt.ArrayLike) -> int:
     """Takes `data` (list/ndarray of ints) and calculates the number of times the values increase as the list is waked.
 
     Examples
@@ -19,10 +20,10 @@ def count_increases(data: Sequence[int]) -> int:
     3
     """
 
-    return np.sum(np.diff(data) > 0)
+    return int(np.sum(np.diff(data) > 0))
 
 
-def create_sliding_window(data: Sequence[int], n: int = 3) -> Sequence[int]:
+def create_sliding_window(data: Sequence[int], n: int = 3) -> np.ndarray:
     """Creates an `n`-sliding window of a list of ints.
 
     Examples
@@ -32,18 +33,188 @@ def create_sliding_window(data: Sequence[int], n: int = 3) -> Sequence[int]:
 
     >>> create_sliding_window([0, 1, 2, 3, 4])
     [3 6 9]
+
+    >>> create_sliding_window([0, 1, 2, 3, 4], n=2)
+    [1 3 5 7]
     """
-    lag_array = np.array(
-        [[data[idx + jdx] for jdx in range(n)] for idx in range(len(data) - 2)]
-    )
-    return np.sum(lag_array, axis=1)
+    # "valid" mode swaps its arguments when the window is longer than the data; there are no windows then.
+    if n > len(data):
+        return np.zeros(0, dtype=int)
+    return np.convolve(data, np.ones(n, dtype=int), mode="valid")
+
+
+def count_window_increases(data: npt.ArrayLike, n: int = 3) -> int:
+    """Counts the times the sum of an `n`-sliding window increases.
+
+    Two neighbouring windows share all but one value each, so the sum increases exactly when `data[i + n] > data[i]`.
+
+    Examples
+    --------
+    >>> count_window_increases([199, 200, 208, 210, 200, 207, 240, 269, 260, 263])
+    5
+    """
+    if n < 1:
+        raise ValueError(f"Window size must be at least 1, got {n}.")
+
+    depths = np.asarray(data)
+    return int(np.sum(depths[n:] > depths[:-n]))
+
+
+def count_window_increases_streaming(
+    chunks: Iterable[npt.ArrayLike], n: int = 3
+) -> int:
+    """Same as `count_window_increases`, but over data arriving in `chunks`.
+
+    The last `n` values of each chunk are carried over to compare against the next, so memory depends only on the
+    chunk size.  (See `read_depth_chunks` for chunking a file.)
+    """
+    if n < 1:
+        raise ValueError(f"Window size must be at least 1, got {n}.")
+
+    carry = np.zeros(0, dtype=np.int64)
+    total = 0
+    for chunk in chunks:
+        buffer = np.concatenate((carry, np.asarray(chunk, dtype=np.int64)))
+        total += int(np.sum(buffer[n:] > buffer[:-n]))
+        carry = buffer[-n:]
+    return total
+
+
+def read_depth_chunks(f: TextIO, chunk_size: int = 1 << 20) -> Iterator[np.ndarray]:
+    """Reads newline-separated depths from `f`, `chunk_size` characters at a time.  A number split across chunks is carried over."""
+    carry = ""
+    while chunk := f.read(chunk_size):
+        chunk = carry + chunk
+        last_newline = chunk.rfind("\n")
+        carry = chunk[last_newline + 1 :]
+        yield np.fromstring(chunk[: last_newline + 1], dtype=np.int64, sep=" ")
+
+    yield np.fromstring(carry, dtype=np.int64, sep=" ")
+
+
+def parse_depth_bytes(raw: np.ndarray) -> np.ndarray:
+    """Parses a uint8 array of ASCII text holding non-negative integers (separated by anything) into an int32 array, without a Python loop per number.
+
+    Examples
+    --------
+    >>> parse_depth_bytes(np.frombuffer(b"199\\n200\\r\\n7\\n", dtype=np.uint8)).tolist()
+    [199, 200, 7]
+    """
+    is_digit = (raw >= ord("0")) & (raw <= ord("9"))
+    digit_idx = np.flatnonzero(is_digit)
+    if len(digit_idx) == 0:
+        return np.zeros(0, dtype=np.int32)
+
+    # A number starts at a digit whose predecessor isn't one, and ends at a digit whose successor isn't one.
+    prev_is_digit = np.concatenate(([False], is_digit[:-1]))
+    next_is_digit = np.concatenate((is_digit[1:], [False]))
+    is_start = is_digit & ~prev_is_digit
+    ends = np.flatnonzero(is_digit & ~next_is_digit)
+
+    # Each digit contributes digit * 10^(places before the end of its number).
+    number_id = np.cumsum(is_start[digit_idx]) - 1
+    places = ends[number_id] - digit_idx
+    digits = (raw[digit_idx] - ord("0")).astype(np.int64)
+    contributions = digits * (10 ** places.astype(np.int64))
+
+    first_digits = np.flatnonzero(is_start[digit_idx])
+    return np.add.reduceat(contributions, first_digits).astype(np.int32)
+
+
+def load_depths(path: str, use_cache: bool = True) -> np.ndarray:
+    """Loads newline-separated depths from `path` as an int32 array.
+
+    The text file is memory-mapped and parsed with `parse_depth_bytes`.  With `use_cache`, the result is saved to a
+    binary sidecar (`<path>.int32.npy`) and later loads memory-map that instead (until `path` is modified again).
+    """
+    cache_path = f"{path}.int32.npy"
+    if (
+        use_cache
+        and os.path.exists(cache_path)
+        and os.path.getmtime(cache_path) >= os.path.getmtime(path)
+    ):
+        return np.load(cache_path, mmap_mode="r")
+
+    if os.path.getsize(path) == 0:
+        depths = np.zeros(0, dtype=np.int32)
+    else:
+        depths = parse_depth_bytes(np.memmap(path, dtype=np.uint8, mode="r"))
+
+    if not use_cache:
+        return depths
+
+    np.save(cache_path, depths)
+    return np.load(cache_path, mmap_mode="r")
+
+
+# -- Tests --
+def test_window_increases() -> None:
+    test_data = [199, 200, 208, 210, 200, 207, 240, 269, 260, 263]
+
+    for n in [1, 2, 3, 4, 9, 10, 11]:
+        expected = count_increases(create_sliding_window(test_data, n))
+        assert count_window_increases(test_data, n) == expected
+
+        for chunk_size in [1, 2, 5, 100]:
+            chunks = [
+                test_data[idx : idx + chunk_size]
+                for idx in range(0, len(test_data), chunk_size)
+            ]
+            assert count_window_increases_streaming(chunks, n) == expected
+
+    # No windows at all when they're longer than the data.
+    assert create_sliding_window([1, 2], n=3).tolist() == []
+    assert create_sliding_window([5, 1, 2, 9], n=6).tolist() == []
+    assert count_window_increases([5, 1, 2, 9], n=6) == 0
+
+    # Windows must hold at least one value.
+    for n in [0, -1]:
+        for count in [
+            lambda: count_window_increases(test_data, n),
+            lambda: count_window_increases_streaming([test_data], n),
+        ]:
+            try:
+                count()
+            except ValueError:
+                continue
+            raise AssertionError(f"Expected ValueError for n={n}.")
+
+
+def test_read_depth_chunks() -> None:
+    test_input = "199\n200\n208\n210\n200\n207\n240\n269\n260\n263\n"
+
+    for chunk_size in [1, 3, 100]:
+        chunks = read_depth_chunks(io.StringIO(test_input), chunk_size)
+        assert count_window_increases_streaming(chunks, 1) == 7
+        chunks = read_depth_chunks(io.StringIO(test_input.strip()), chunk_size)
+        assert count_window_increases_streaming(chunks, 3) == 5
+
+
+def test_load_depths() -> None:
+    test_input = "199\n200\n208\n210\n200\n207\n240\n269\n260\n263\n"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "depths.csv")
+        with open(path, "w") as f:
+            f.write(test_input)
+
+        depths = load_depths(path)
+        assert depths.dtype == np.int32
+        assert depths.tolist() == list(map(int, test_input.split()))
+        assert os.path.exists(f"{path}.int32.npy")
+
+        cached = load_depths(path)
+        assert isinstance(cached, np.memmap)
+        assert cached.tolist() == depths.tolist()
+
+        assert load_depths(path, use_cache=False).tolist() == depths.tolist()
 
 
 if __name__ == "__main__":
 
-    data = np.genfromtxt(os.path.abspath("aoc/data/a01.csv"), delimiter=",")
+    data = load_depths(os.path.abspath("aoc/data/a01.csv"))
 
     solution_a = count_increases(data)
-    solution_b = count_increases(create_sliding_window(data))
+    solution_b = count_window_increases(data, n=3)
 
     print(f"AOC1a: {solution_a}\nAOC1b: {solution_b}")
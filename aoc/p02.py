@@ -2,8 +2,22 @@
 Code for https://adventofcode.com/2021/day/2
 """
 
+import bisect
+import io
+import itertools
 import os
+from collections import namedtuple
 from dataclasses import dataclass
+from typing import Iterable, Optional, TextIO
+
+import numpy as np
+
+# Opcodes for the vectorized `CommandLog`.
+FORWARD, DOWN, UP = 0, 1, 2
+OPCODES = {"forward": FORWARD, "down": DOWN, "up": UP}
+
+# Running state of a `SubmarineTelemetry`.  In Part 1's interpretation, `aim` is the depth.
+SubmarineState = namedtuple("SubmarineState", ("horizontal", "depth", "aim"))
 
 
 @dataclass
@@ -89,16 +103,210 @@ class Submarine:
         return cls(directions=parsed_dirs)
 
 
+class CommandLog:
+    """
+    Submarine commands as two integer arrays, (opcode, magnitude), so both interpretations of the commands are
+    computed with array sums instead of stepping through them (see `Submarine` for the step-by-step version).
+    """
+
+    def __init__(self, opcodes: np.ndarray, magnitudes: np.ndarray) -> None:
+        self.opcodes = opcodes
+        self.magnitudes = magnitudes
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+    def aim_changes(self) -> np.ndarray:
+        """Change in aim (Part 2), or depth (Part 1), from each command: +X for down, -X for up, 0 for forward."""
+        return np.where(
+            self.opcodes == DOWN,
+            self.magnitudes,
+            np.where(self.opcodes == UP, -self.magnitudes, 0),
+        )
+
+    def forward_moves(self) -> np.ndarray:
+        """Horizontal move from each command: X for forward, 0 otherwise."""
+        return np.where(self.opcodes == FORWARD, self.magnitudes, 0)
+
+    def commands_part_1(self) -> Coord:
+        """End location with up/down changing the depth directly.  Same as `Submarine.commands_part_1`."""
+        return Coord(int(self.forward_moves().sum()), int(self.aim_changes().sum()))
+
+    def commands_part_2(self) -> Coord:
+        """End location with up/down changing the aim.  Same as `Submarine.commands_part_2`.
+
+        The aim at each command is the cumulative sum of the aim changes, and forward X adds X * aim to the depth.
+        """
+        forward_moves = self.forward_moves()
+        aim = np.cumsum(self.aim_changes())
+        return Coord(int(forward_moves.sum()), int((forward_moves * aim).sum()))
+
+    @classmethod
+    def parse_commands(cls, raw_input: str) -> "CommandLog":
+        """Takes raw input data from aoc2.csv and parses it into opcode and magnitude arrays."""
+        tokens = raw_input.split()
+        names, name_idx = np.unique(tokens[0::2], return_inverse=True)
+
+        unknown = set(names.tolist()) - OPCODES.keys()
+        if unknown:
+            raise ValueError(f"Directions {unknown} are not valid directions!")
+
+        opcodes = np.array([OPCODES[name] for name in names.tolist()], dtype=np.int8)
+        magnitudes = np.array(tokens[1::2], dtype=np.int64)
+        return cls(opcodes[name_idx], magnitudes)
+
+
+class SubmarineTelemetry:
+    """
+    Incremental submarine that consumes commands in chunks as they arrive, keeping a running (horizontal, depth, aim).
+
+    With `checkpoint_interval`, the state every `checkpoint_interval` commands is kept along with the commands
+    themselves (as compact arrays, not `Coord` objects), so the state after any number of commands can be recovered
+    by replaying at most `checkpoint_interval` of them.
+    """
+
+    def __init__(self, checkpoint_interval: Optional[int] = None) -> None:
+        self.checkpoint_interval = checkpoint_interval
+        self.state = SubmarineState(0, 0, 0)
+        self.num_commands = 0
+
+        self.checkpoints: list[SubmarineState] = [self.state]
+        self._chunks: list[CommandLog] = []
+        self._chunk_starts: list[int] = []
+
+    def consume(self, log: CommandLog) -> SubmarineState:
+        """Applies a chunk of commands, returns the new state."""
+        if len(log) == 0:
+            return self.state
+
+        horizontals, depths, aims = _cumulative_states(self.state, log)
+
+        if self.checkpoint_interval is not None:
+            interval = self.checkpoint_interval
+            # Command counts in this chunk that land on a checkpoint.
+            first = (self.num_commands // interval + 1) * interval
+            for count in range(first, self.num_commands + len(log) + 1, interval):
+                idx = count - self.num_commands - 1
+                self.checkpoints.append(
+                    SubmarineState(
+                        int(horizontals[idx]), int(depths[idx]), int(aims[idx])
+                    )
+                )
+            self._chunks.append(log)
+            self._chunk_starts.append(self.num_commands)
+
+        self.state = SubmarineState(
+            int(horizontals[-1]), int(depths[-1]), int(aims[-1])
+        )
+        self.num_commands += len(log)
+        return self.state
+
+    def consume_lines(
+        self, lines: Iterable[str], chunk_size: int = 100_000
+    ) -> SubmarineState:
+        """Consumes command lines (eg. a file or a live feed) `chunk_size` at a time, returns the final state."""
+        line_iter = iter(lines)
+        while chunk := list(itertools.islice(line_iter, chunk_size)):
+            self.consume(CommandLog.parse_commands("\n".join(chunk)))
+        return self.state
+
+    def consume_file(self, f: TextIO, chunk_size: int = 100_000) -> SubmarineState:
+        return self.consume_lines(f, chunk_size)
+
+    def position_at(self, k: int) -> SubmarineState:
+        """State after the first `k` commands, replaying at most `checkpoint_interval` commands."""
+        if k == self.num_commands:
+            return self.state
+        if self.checkpoint_interval is None:
+            raise ValueError("Past positions need a `checkpoint_interval`.")
+        if not 0 <= k <= self.num_commands:
+            raise IndexError(f"Only {self.num_commands} commands have been consumed.")
+
+        checkpoint_idx = k // self.checkpoint_interval
+        start = checkpoint_idx * self.checkpoint_interval
+        state = self.checkpoints[checkpoint_idx]
+        if k == start:
+            return state
+
+        horizontals, depths, aims = _cumulative_states(
+            state, self._commands_between(start, k)
+        )
+        return SubmarineState(int(horizontals[-1]), int(depths[-1]), int(aims[-1]))
+
+    def _commands_between(self, start: int, stop: int) -> CommandLog:
+        """Commands [start, stop) from the stored chunks."""
+        first_chunk = bisect.bisect_right(self._chunk_starts, start) - 1
+        opcodes, magnitudes = [], []
+        for chunk, chunk_start in zip(
+            self._chunks[first_chunk:], self._chunk_starts[first_chunk:]
+        ):
+            if chunk_start >= stop:
+                break
+            lo = max(start - chunk_start, 0)
+            hi = min(stop - chunk_start, len(chunk))
+            opcodes.append(chunk.opcodes[lo:hi])
+            magnitudes.append(chunk.magnitudes[lo:hi])
+        return CommandLog(np.concatenate(opcodes), np.concatenate(magnitudes))
+
+
+def _cumulative_states(
+    state: SubmarineState, log: CommandLog
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Horizontal, depth and aim after each command of `log`, starting from `state`."""
+    forward_moves = log.forward_moves()
+    aims = state.aim + np.cumsum(log.aim_changes())
+    horizontals = state.horizontal + np.cumsum(forward_moves)
+    depths = state.depth + np.cumsum(forward_moves * aims)
+    return horizontals, depths, aims
+
+
+# -- Tests --
+TEST_INPUT = "forward 5\ndown 5\nforward 8\nup 3\ndown 8\nforward 2"
+
+
+def test_command_log() -> None:
+    submarine = Submarine.parse_directions(TEST_INPUT)
+    log = CommandLog.parse_commands(TEST_INPUT)
+
+    assert len(log) == 6
+    assert repr(log.commands_part_1()) == repr(submarine.commands_part_1())
+    assert repr(log.commands_part_1()) == "Coord(15, 10)"
+    assert repr(log.commands_part_2()) == repr(submarine.commands_part_2())
+    assert repr(log.commands_part_2()) == "Coord(15, 60)"
+
+
+def test_submarine_telemetry() -> None:
+    lines = TEST_INPUT.splitlines()
+
+    # State after each number of commands, from the step-by-step Submarine.
+    expected = []
+    for k in range(len(lines) + 1):
+        submarine = Submarine.parse_directions("\n".join(lines[:k]))
+        part_1, part_2 = submarine.commands_part_1(), submarine.commands_part_2()
+        expected.append(SubmarineState(part_2.x, part_2.y, part_1.y))
+
+    for chunk_size in [1, 4, 100]:
+        for checkpoint_interval in [1, 4, 100]:
+            telemetry = SubmarineTelemetry(checkpoint_interval)
+            final = telemetry.consume_file(io.StringIO(TEST_INPUT), chunk_size)
+            assert final == SubmarineState(15, 60, 10)
+            assert [telemetry.position_at(k) for k in range(7)] == expected
+
+    telemetry = SubmarineTelemetry()
+    assert telemetry.consume_lines(lines, chunk_size=2) == SubmarineState(15, 60, 10)
+    assert len(telemetry.checkpoints) == 1
+
+
 if __name__ == "__main__":
     with open(os.path.abspath("aoc/data/a02.csv"), "r") as f:
         data = f.read().strip()
 
-    submarine = Submarine.parse_directions(data)
+    log = CommandLog.parse_commands(data)
 
-    result_a = submarine.commands_part_1()
+    result_a = log.commands_part_1()
     solution_a = result_a.x * result_a.y
 
-    result_b = submarine.commands_part_2()
+    result_b = log.commands_part_2()
     solution_b = result_b.x * result_b.y
 
     print(f"AOC2a: {solution_a}\nAOC2b: {solution_b}")
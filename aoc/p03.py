@@ -2,79 +2,388 @@
 Code for https://adventofcode.com/2021/day/3
 """
 
+import io
+import operator
 import os
-from typing import Sequence
+from functools import reduce
+from typing import BinaryIO, Iterable, Optional, Sequence
 
 import numpy as np
 
 
 class Report:
     """
-    Class to manage Data for AOC Day 3.
+    Class to manage Data for AOC Day 3.  Each line of the report is stored as a packed unsigned integer.
     """
 
-    def __init__(self, data: np.ndarray):
+    def __init__(self, data: np.ndarray, num_bits: int):
+        """Diagnostic report.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            1-D uint64 array, one packed integer per line of the report.
+        num_bits : int
+            Number of binary digits in each line.
+        """
         self.data = data
+        self.num_bits = num_bits
+        self._rating_indexes: dict[tuple[int, ...], "RatingIndex"] = {}
 
-    def calculate_part_1(self) -> int:
-        """Calculates the gamma and epsilon rate for Part 1, returns the product."""
-        gamma_rate = [
-            "1" if Report._mode_is_one(self.data[:, idx]) else "0"
-            for idx in range(len(self.data[0]))
-        ]
-        gamma_rate_val = Report._convert_bin_list_to_int(gamma_rate)
+    def column_ones(self) -> np.ndarray:
+        """Returns the number of ones in each bit column, most significant bit first."""
+        return np.array(
+            [
+                int(((self.data >> np.uint64(shift)) & np.uint64(1)).sum())
+                for shift in range(self.num_bits - 1, -1, -1)
+            ]
+        )
 
-        epsilon_rate = [
-            "0" if Report._mode_is_one(self.data[:, idx]) else "1"
-            for idx in range(len(self.data[0]))
-        ]
-        epsilon_rate_val = Report._convert_bin_list_to_int(epsilon_rate)
+    def column_counts(self) -> "ColumnCounts":
+        """Returns the per-column statistics of the report."""
+        return ColumnCounts(self.column_ones(), len(self.data))
 
-        return gamma_rate_val * epsilon_rate_val
+    def rating_index(self, bit_order: Optional[Sequence[int]] = None) -> "RatingIndex":
+        """Returns the (cached) `RatingIndex` of the report for `bit_order`, see `RatingIndex`."""
+        key = tuple(range(self.num_bits) if bit_order is None else bit_order)
+        if key not in self._rating_indexes:
+            self._rating_indexes[key] = RatingIndex(self, key)
+        return self._rating_indexes[key]
+
+    def calculate_part_1(self) -> int:
+        """Calculates the gamma and epsilon rate for Part 1, returns the product."""
+        return self.column_counts().power_consumption()
 
     def calculate_part_2(self) -> int:
         """Looks at the mode for each column and picks the corresponding rows which either have mode 1 or 0 (depending on oxy or co2)."""
-        oxy_rating = self.data.copy()
-        co2_rating = self.data.copy()
-
-        # TODO: How to DRY this?
-        idx = 0
-        while len(oxy_rating) > 1 and idx < len(self.data[0]):
-            oxy_desired_bit = int(Report._mode_is_one(oxy_rating[:, idx]))
-            oxy_rating = np.array(
-                [row for row in oxy_rating if row[idx] == oxy_desired_bit]
-            )
-            idx += 1
+        sorted_data = np.sort(self.data)
+        oxy_sol_value = self._rating(sorted_data, keep_most_common=True)
+        co2_sol_value = self._rating(sorted_data, keep_most_common=False)
+
+        return oxy_sol_value * co2_sol_value
+
+    def _rating(self, sorted_data: np.ndarray, keep_most_common: bool) -> int:
+        """Finds the oxygen (`keep_most_common`) or CO2 rating from the sorted report.
 
-        idx = 0
-        while len(co2_rating) > 1 and idx < len(self.data[0]):
-            co2_desired_bit = int(not Report._mode_is_one(co2_rating[:, idx]))
-            co2_rating = np.array(
-                [row for row in co2_rating if row[idx] == co2_desired_bit]
+        Rows that are still candidates always share their leading bits, so in sorted order they are a contiguous range
+        [lo, hi), and within it the rows with a 0 in the next bit come before the rows with a 1.  Each bit is then one
+        binary search for the split point.
+        """
+        lo, hi = 0, len(sorted_data)
+        for shift in range(self.num_bits - 1, -1, -1):
+            if hi - lo <= 1:
+                break
+
+            prefix = int(sorted_data[lo]) >> (shift + 1) << (shift + 1)
+            split = lo + int(
+                np.searchsorted(
+                    sorted_data[lo:hi], np.uint64(prefix | (1 << shift)), side="left"
+                )
             )
-            idx += 1
 
-        oxy_sol_value = Report._convert_bin_list_to_int(oxy_rating[0])
-        co2_sol_value = Report._convert_bin_list_to_int(co2_rating[0])
+            keep_ones = Report._one_is_common(hi - split, hi - lo) == keep_most_common
+            lo, hi = (split, hi) if keep_ones else (lo, split)
 
-        return oxy_sol_value * co2_sol_value
+        if hi - lo < 1:
+            raise ValueError("No row matches the bit criteria.")
+
+        return int(sorted_data[lo])
+
+    @staticmethod
+    def _one_is_common(ones: int, count: int) -> bool:
+        """Returns True if the mode of a binary column with `ones` ones out of `count` is 1 (ties go to 1)."""
+        return 2 * ones >= count
 
     @staticmethod
-    def _mode_is_one(seq: Sequence) -> bool:
-        """Returns True if the mode of a binary sequence `seq` is 1."""
-        return sum(seq) >= len(seq) / 2
+    def _ones_are_common(ones: np.ndarray, count: int) -> np.ndarray:
+        """Returns True where the mode of a binary column with `ones` ones out of `count` is 1 (ties go to 1)."""
+        return 2 * ones >= count
 
     @staticmethod
-    def _convert_bin_list_to_int(s: list[str]) -> int:
-        """Converts a list of binary values to a decimal.  Eg, '0010' -> 2."""
-        return int("".join(map(str, s)), base=2)
+    def _bits_to_int(bits: np.ndarray) -> int:
+        """Converts an array of binary values, most significant first, to a decimal.  Eg, [0, 0, 1, 0] -> 2."""
+        value = 0
+        for bit in bits:
+            value = (value << 1) | int(bit)
+        return value
 
     @classmethod
     def parse_input(cls, raw_input: str) -> "Report":
-        """Takes raw input data from aoc3.csv (lines of binary) and returns an ndarray where each col/row is the corresponding binary digit from the input."""
+        """Takes raw input data from aoc3.csv (lines of binary) and returns a Report of the lines packed into integers."""
+
+        lines = raw_input.split()
+        num_bits = len(lines[0])
+        bits = np.frombuffer("".join(lines).encode(), dtype=np.uint8) - ord("0")
+        place_values = np.uint64(1) << np.arange(num_bits - 1, -1, -1, dtype=np.uint64)
+        data = bits.reshape(-1, num_bits).astype(np.uint64) @ place_values
+        return cls(data, num_bits)
+
+
+class RatingIndex:
+    """
+    Binary trie of a report's rows, for answering many oxygen/CO2-style rating queries.
+
+    The trie is stored level by level: `nodes[depth]` maps each `depth`-bit prefix (in `bit_order`) to
+    (number of rows with that prefix, one such row).  Building it costs O(rows * bits) once; each query is then
+    O(bits) dictionary lookups.
+    """
+
+    def __init__(self, report: Report, bit_order: Sequence[int]) -> None:
+        """Index of `report`.
+
+        Parameters
+        ----------
+        report : Report
+            The report to index.
+        bit_order : Sequence[int]
+            Columns to apply the bit criteria to, in order.  Column 0 is the leftmost (most significant) digit.
+        """
+        self.bit_order = tuple(bit_order)
+        self.num_bits = len(self.bit_order)
+
+        # Re-pack each row so the columns in `bit_order` become its bits, most significant first.
+        keys = np.zeros_like(report.data)
+        for depth, col in enumerate(self.bit_order):
+            bit = (report.data >> np.uint64(report.num_bits - 1 - col)) & np.uint64(1)
+            keys |= bit << np.uint64(self.num_bits - 1 - depth)
+
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        rows = report.data[order]
+
+        self.nodes: list[dict[int, tuple[int, int]]] = []
+        for depth in range(self.num_bits + 1):
+            prefixes = keys >> np.uint64(self.num_bits - depth)
+            unique, first_idx, counts = np.unique(
+                prefixes, return_index=True, return_counts=True
+            )
+            self.nodes.append(
+                dict(
+                    zip(
+                        unique.tolist(),
+                        zip(counts.tolist(), rows[first_idx].tolist()),
+                    )
+                )
+            )
+
+    def rating(
+        self, keep_most_common: bool = True, tie_bit: Optional[int] = None
+    ) -> int:
+        """Walks the trie keeping the rows with the most (or least) common bit, until one row is left.
+
+        Parameters
+        ----------
+        keep_most_common : bool, optional
+            Keep the most common bit (oxygen) or the least common one (CO2), by default True
+        tie_bit : Optional[int], optional
+            Bit to keep when 0 and 1 are equally common, by default 1 for most common and 0 for least common.
+
+        Returns
+        -------
+        int
+            The rating, ie. the remaining row.
+        """
+        if tie_bit is None:
+            tie_bit = int(keep_most_common)
+
+        prefix = 0
+        for depth in range(self.num_bits):
+            count, row = self.nodes[depth][prefix]
+            if count == 1:
+                return row
+
+            ones = self.nodes[depth + 1].get(2 * prefix + 1, (0, 0))[0]
+            zeros = count - ones
+            if ones == zeros:
+                bit = tie_bit
+            else:
+                bit = int((ones > zeros) == keep_most_common)
+
+            prefix = 2 * prefix + bit
+            if prefix not in self.nodes[depth + 1]:
+                raise ValueError("No row matches the bit criteria.")
+
+        return self.nodes[self.num_bits][prefix][1]
+
+
+class ColumnCounts:
+    """
+    Number of ones in each bit column of a diagnostic report, and the number of rows.  This is all Part 1 needs,
+    so it can be built by streaming a file of any size, and partial counts (eg. from several files or workers) can be added together.
+    """
+
+    def __init__(self, ones: np.ndarray, num_rows: int) -> None:
+        self.ones = ones.astype(np.int64)
+        self.num_rows = num_rows
+
+    @property
+    def num_bits(self) -> int:
+        return len(self.ones)
+
+    def __repr__(self) -> str:
+        return f"ColumnCounts(ones={self.ones.tolist()}, num_rows={self.num_rows})"
+
+    def __add__(self, other: "ColumnCounts") -> "ColumnCounts":
+        # Counts of no rows (eg. an empty shard) don't know their width; they add nothing.
+        if not other.num_rows:
+            return self
+        if not self.num_rows:
+            return other
+        if self.num_bits != other.num_bits:
+            raise ValueError(
+                f"Can't merge counts with {self.num_bits} and {other.num_bits} bits!"
+            )
+        return ColumnCounts(self.ones + other.ones, self.num_rows + other.num_rows)
+
+    def gamma_rate(self) -> int:
+        return Report._bits_to_int(Report._ones_are_common(self.ones, self.num_rows))
+
+    def epsilon_rate(self) -> int:
+        return ~self.gamma_rate() & ((1 << self.num_bits) - 1)
+
+    def power_consumption(self) -> int:
+        """Product of the gamma and epsilon rates (the answer to Part 1)."""
+        return self.gamma_rate() * self.epsilon_rate()
+
+    @classmethod
+    def merge(cls, counts: Iterable["ColumnCounts"]) -> "ColumnCounts":
+        """Adds together partial counts, eg. from several files or workers."""
+        return reduce(operator.add, counts, cls(np.zeros(0, dtype=np.int64), 0))
+
+    @classmethod
+    def from_stream(cls, f: BinaryIO, chunk_size: int = 1 << 20) -> "ColumnCounts":
+        """Counts the ones in each column of a binary-mode report `f`, reading `chunk_size` bytes at a time.
+
+        A line split across two chunks is carried over to the next one, so memory use doesn't depend on the file size.
+        """
+        ones = np.zeros(0, dtype=np.int64)
+        num_rows = 0
+        carry = b""
+        while True:
+            chunk = f.read(chunk_size)
+            buffer = carry + chunk
+
+            # Only parse complete lines, unless we're at the end of the file.
+            end = buffer.rfind(b"\n") + 1 if chunk else len(buffer)
+            carry = buffer[end:]
+
+            raw = np.frombuffer(buffer[:end], dtype=np.uint8)
+            digits = raw[(raw == ord("0")) | (raw == ord("1"))]
+            if len(digits):
+                if not len(ones):  # Width comes from the first non-empty line.
+                    num_bits = next(
+                        len(line.strip())
+                        for line in buffer[:end].split(b"\n")
+                        if line.strip()
+                    )
+                    ones = np.zeros(num_bits, dtype=np.int64)
+
+                rows = (digits - ord("0")).reshape(-1, len(ones))
+                ones += rows.sum(axis=0, dtype=np.int64)
+                num_rows += len(rows)
+
+            if not chunk:
+                break
+
+        return cls(ones, num_rows)
+
+    @classmethod
+    def from_file(cls, path: str, chunk_size: int = 1 << 20) -> "ColumnCounts":
+        with open(path, "rb") as f:
+            return cls.from_stream(f, chunk_size)
+
+
+# -- Tests --
+TEST_INPUT = "\n".join(
+    [
+        "00100",
+        "11110",
+        "10110",
+        "10111",
+        "10101",
+        "01111",
+        "00111",
+        "11100",
+        "10000",
+        "11001",
+        "00010",
+        "01010",
+    ]
+)
+
+
+def test_examples() -> None:
+    report = Report.parse_input(TEST_INPUT)
+
+    assert report.data.tolist() == [int(line, 2) for line in TEST_INPUT.split()]
+    assert report.column_ones().tolist() == [7, 5, 8, 7, 5]
+    assert report.calculate_part_1() == 198
+    assert report.calculate_part_2() == 230
+
+
+def test_rating_index() -> None:
+    report = Report.parse_input(TEST_INPUT)
+
+    index = report.rating_index()
+    assert index.rating(keep_most_common=True) == 23
+    assert index.rating(keep_most_common=False) == 10
+    assert report.rating_index() is index
+
+    def filter_rating(
+        bit_order: list[int], keep_most_common: bool, tie_bit: int
+    ) -> Optional[int]:
+        """Reference: filters the rows one column at a time.  None if no row is left."""
+        rows = TEST_INPUT.split()
+        for col in bit_order:
+            if len(rows) == 1:
+                break
+            ones = sum(row[col] == "1" for row in rows)
+            zeros = len(rows) - ones
+            bit = tie_bit if ones == zeros else int((ones > zeros) == keep_most_common)
+            rows = [row for row in rows if row[col] == str(bit)]
+        return int(rows[0], 2) if rows else None
+
+    for bit_order in [[0, 1, 2, 3, 4], [4, 3, 2, 1, 0], [2, 0, 4, 1, 3]]:
+        index = report.rating_index(bit_order)
+        for keep_most_common in [True, False]:
+            for tie_bit in [0, 1]:
+                expected = filter_rating(bit_order, keep_most_common, tie_bit)
+                try:
+                    value: Optional[int] = index.rating(keep_most_common, tie_bit)
+                except ValueError:
+                    value = None
+                assert value == expected, f"Expected {expected}, got {value}"
+
+
+def test_streamed_column_counts() -> None:
+    expected = Report.parse_input(TEST_INPUT).column_counts()
+
+    for chunk_size in [1, 7, 1 << 20]:
+        counts = ColumnCounts.from_stream(io.BytesIO(TEST_INPUT.encode()), chunk_size)
+        assert counts.ones.tolist() == expected.ones.tolist()
+        assert counts.num_rows == 12
+        assert counts.power_consumption() == 198
+
+    # Partial counts (eg. one per worker) merge into the full one.
+    lines = TEST_INPUT.replace("\n", "\r\n").encode().splitlines(keepends=True)
+    parts = [
+        ColumnCounts.from_stream(io.BytesIO(b"".join(lines[idx : idx + 5])))
+        for idx in range(0, len(lines), 5)
+    ]
+    merged = ColumnCounts.merge(parts)
+    assert merged.num_rows == 12 and merged.power_consumption() == 198
+
+    # Empty shards (eg. an idle worker) and leading blank lines don't break anything.
+    empty = ColumnCounts.from_stream(io.BytesIO(b""))
+    assert empty.num_rows == 0
+    merged = ColumnCounts.merge([empty] + parts + [empty])
+    assert merged.num_rows == 12 and merged.power_consumption() == 198
+    assert ColumnCounts.merge([]).num_rows == 0
 
-        data = np.array([list(map(int, list(row))) for row in raw_input.splitlines()])
-        return cls(data)
+    for chunk_size in [1, 1 << 20]:
+        padded = io.BytesIO(b"\n\n" + TEST_INPUT.encode())
+        counts = ColumnCounts.from_stream(padded, chunk_size)
+        assert counts.num_rows == 12 and counts.power_consumption() == 198
 
 
 if __name__ == "__main__":
@@ -2,11 +2,18 @@
 Code for https://adventofcode.com/2021/day/4
 """
 
+import io
 import os
+from collections import deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterable, Iterator, Optional, TextIO
 
 import numpy as np
 import numpy.ma as ma
 
+# A board winning on a live call.  `turn` is the 0-based index of the call.
+WinEvent = namedtuple("WinEvent", ("board_idx", "call", "turn", "score"))
+
 
 class Board:
     """
@@ -75,6 +82,10 @@ class Boards:
         """Removes Board from the Boards collection."""
         self.boards.remove(board)
 
+    def to_array(self) -> np.ndarray:
+        """Stacks all boards into one (num_boards, size, size) array."""
+        return np.stack([board.board for board in self.boards]).astype(np.int64)
+
     @classmethod
     def parse_input(cls, data: str) -> "Boards":
         boards_raw = [board.split("\n") for board in data.split("\n\n")]
@@ -82,54 +93,367 @@ class Boards:
         return cls(boards=boards)
 
 
-if __name__ == "__main__":
+class WinRanking:
+    """The turn and score each board wins with, answering first/last/nth-winner queries with no simulation."""
 
-    # Initialize Data.
-    with open(os.path.abspath("aoc/data/a04_boards.csv"), "r") as f:
-        data = f.read()
+    def __init__(
+        self, calls: np.ndarray, win_turns: np.ndarray, scores: np.ndarray
+    ) -> None:
+        """Ranking of winning boards.
 
-    with open("aoc/data/a04_calls.csv", "r") as calls_f:
-        calls = np.genfromtxt(calls_f, delimiter=",", encoding="utf-8")
+        Parameters
+        ----------
+        calls : np.ndarray
+            Array of integer calls, in order.
+        win_turns : np.ndarray
+            Index into `calls` of the call each board wins on, `len(calls)` if it never wins.
+        scores : np.ndarray
+            Score of each board at the call it wins on (0 for boards that never win).
+        """
+        self.calls = calls.astype(np.int64)
+        self.num_calls = len(self.calls)
+        self.win_turns = win_turns
+        self.scores = scores
 
-    boards = Boards.parse_input(data)
-    num_boards = len(boards)
+        # Boards in the order they win; ties keep the board order.  Boards that never win are left out.
+        order = np.argsort(self.win_turns, kind="stable")
+        self.win_order = order[self.win_turns[order] < self.num_calls]
+
+    def __len__(self) -> int:
+        return len(self.win_turns)
+
+    def nth_to_win(self, n: int = 1) -> tuple[int, int]:
+        """Finds the nth board to win at Bingo and the call it won at.
+
+        Parameters
+        ----------
+        n : int, optional
+            1 for the first winner, `len(self)` for the last (if every board wins), by default 1
+
+        Returns
+        -------
+        tuple[int, int]
+            Index of the winning board and the call it won on.  (-1, -1) if fewer than `n` boards win.
+        """
+        if not 1 <= n <= len(self.win_order):
+            return (-1, -1)
+
+        board_idx = int(self.win_order[n - 1])
+        return (board_idx, int(self.calls[self.win_turns[board_idx]]))
+
+    def nth_to_win_score(self, n: int = 1) -> int:
+        """Score of the nth board to win, or -1 if fewer than `n` boards win."""
+        board_idx, _ = self.nth_to_win(n)
+        return -1 if board_idx == -1 else int(self.scores[board_idx])
+
+    def first_to_win_score(self) -> int:
+        return self.nth_to_win_score(1)
+
+    def last_to_win_score(self) -> int:
+        return self.nth_to_win_score(len(self.win_order))
+
+
+class BingoEngine(WinRanking):
+    """
+    Works out the turn each board wins on for a known sequence of calls, without replaying the game.
+
+    Each number is mapped to its call rank (the turn it's called on).  A line is complete at the latest rank in it,
+    so a board wins at the minimum over its rows and columns of the maximum rank.
+    """
+
+    def __init__(self, boards: np.ndarray, calls: np.ndarray) -> None:
+        """Bingo engine.
 
-    def nth_to_win(boards: Boards, calls: np.ndarray, n: int = 1) -> tuple[Board, int]:
+        Parameters
+        ----------
+        boards : np.ndarray
+            (num_boards, size, size) array of the board numbers.
+        calls : np.ndarray
+            Array of integer calls, in order.
         """
-            Finds the nth board to win at Bingo (or the first if a few have won) and the call it won at.
-            Returns (Trivial Board, -1) if no board wins.
+        self.boards = boards.astype(np.int64)
+        calls = calls.astype(np.int64)
+        num_calls = len(calls)
+
+        # Rank of the first time each number is called.  Numbers never called rank `num_calls`.
+        max_number = int(max(self.boards.max(), calls.max(initial=0)))
+        call_rank = np.full(max_number + 1, num_calls, dtype=np.int64)
+        called, first_calls = np.unique(calls, return_index=True)
+        call_rank[called] = first_calls
+        self.ranks = call_rank[self.boards]
+
+        row_turns = self.ranks.max(axis=2).min(axis=1)
+        col_turns = self.ranks.max(axis=1).min(axis=1)
+        win_turns = np.minimum(row_turns, col_turns)
+
+        unmarked = self.ranks > win_turns[:, None, None]
+        unmarked_sums = (self.boards * unmarked).sum(axis=(1, 2))
+        scores = unmarked_sums * np.append(calls, 0)[win_turns]
+
+        super().__init__(calls, win_turns, scores)
+
+    @classmethod
+    def from_boards(cls, boards: Boards, calls: np.ndarray) -> "BingoEngine":
+        return cls(boards.to_array(), calls)
+
+
+class OnlineBingo:
+    """
+    Bingo game where calls arrive one at a time and winners are reported as soon as they win.
+
+    A reverse index maps each number to the (board, row, col) cells holding it, and each board keeps hit counters
+    per row and column, so a call only touches the cells with that number instead of every board.
+    """
+
+    def __init__(self, boards: Boards) -> None:
+        board_array = boards.to_array()
+        num_boards, self.size, _ = board_array.shape
+
+        # Reverse index: number -> (board indexes, rows, cols) of every cell holding it.
+        flat = board_array.ravel()
+        order = np.argsort(flat, kind="stable")
+        numbers, starts = np.unique(flat[order], return_index=True)
+        board_idxs, rows, cols = np.unravel_index(order, board_array.shape)
+        self.index: dict[int, tuple[np.ndarray, np.ndarray, np.ndarray]] = {
+            int(number): (board_idxs[cells], rows[cells], cols[cells])
+            for number, cells in zip(
+                numbers, np.split(np.arange(len(flat)), starts[1:])
+            )
+        }
+
+        self.row_hits = np.zeros((num_boards, self.size), dtype=np.int64)
+        self.col_hits = np.zeros((num_boards, self.size), dtype=np.int64)
+        self.unmarked_sums = board_array.sum(axis=(1, 2))
+        self.has_won = np.zeros(num_boards, dtype=bool)
+        self.called: set[int] = set()
+        self.turn = 0
+
+    def call(self, number: int) -> list[WinEvent]:
+        """Marks `number` on every board holding it.  Returns the boards that won on this call, in board order."""
+        number = int(number)
+        turn = self.turn
+        self.turn += 1
+        if number in self.called or number not in self.index:
+            return []
+        self.called.add(number)
+
+        board_idxs, rows, cols = self.index[number]
+        np.add.at(self.row_hits, (board_idxs, rows), 1)
+        np.add.at(self.col_hits, (board_idxs, cols), 1)
+        np.subtract.at(self.unmarked_sums, board_idxs, number)
+
+        completes_line = (self.row_hits[board_idxs, rows] == self.size) | (
+            self.col_hits[board_idxs, cols] == self.size
+        )
+        winners = np.unique(board_idxs[completes_line & ~self.has_won[board_idxs]])
+        self.has_won[winners] = True
+
+        return [
+            WinEvent(int(idx), number, turn, int(self.unmarked_sums[idx]) * number)
+            for idx in winners
+        ]
+
+    def play(self, calls: Iterable[int]) -> Iterator[WinEvent]:
+        """Consumes `calls` (eg. a live feed) and yields each winning board as soon as it wins."""
+        for number in calls:
+            yield from self.call(number)
+
+
+class ShardedBingo(WinRanking):
+    """
+    Win turns and scores for boards streamed from a file in shards, each shard evaluated by a `BingoEngine`
+    in a worker process.  Only the per-board results (not the boards) are kept, so this scales to millions of boards.
+    """
+
+    @classmethod
+    def from_stream(
+        cls,
+        f: TextIO,
+        calls: np.ndarray,
+        boards_per_shard: int = 10_000,
+        max_workers: Optional[int] = None,
+    ) -> "ShardedBingo":
+        """Evaluates the boards in `f` (same format as a04_boards.csv) against `calls`.
 
         Parameters
         ----------
-        boards : Boards
-            Boards object, collection of all bingo Board objects.
+        f : TextIO
+            Boards separated by blank lines.
         calls : np.ndarray
-            Array of integer calls for Board objects.
+            Array of integer calls, in order.
+        boards_per_shard : int, optional
+            Number of boards sent to a worker at a time, by default 10_000
+        max_workers : Optional[int], optional
+            Number of worker processes, by default `os.cpu_count()`.
 
         Returns
         -------
-        tuple[Board, int]
-            The winning board and the call it won on.  The trivial (zeros) board and -1 if no board wins.
+        ShardedBingo
+            The merged results, with boards numbered in file order.
         """
+        calls = calls.astype(np.int64)
+        max_workers = max_workers or os.cpu_count() or 1
+
+        win_turns: list[np.ndarray] = []
+        scores: list[np.ndarray] = []
+
+        # Shards are submitted in file order and collected in the same order, with a bounded
+        # number in flight so the reader doesn't get ahead of the workers.
+        pending: deque[Future] = deque()
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for shard in _iter_board_shards(f, boards_per_shard):
+                pending.append(executor.submit(_evaluate_shard, shard, calls))
+                if len(pending) >= 2 * max_workers:
+                    shard_turns, shard_scores = pending.popleft().result()
+                    win_turns.append(shard_turns)
+                    scores.append(shard_scores)
+
+            while pending:
+                shard_turns, shard_scores = pending.popleft().result()
+                win_turns.append(shard_turns)
+                scores.append(shard_scores)
+
+        empty = np.zeros(0, dtype=np.int64)
+        return cls(
+            calls,
+            np.concatenate(win_turns) if win_turns else empty,
+            np.concatenate(scores) if scores else empty,
+        )
 
-        num_winning_boards = 0
-        for call in calls:
-            boards._mark_cards(call)
-            if len(winning_boards := boards._board_has_won()) > 0:
-                num_winning_boards += len(winning_boards)
-                for winning_board in winning_boards:
-                    boards._remove_board(winning_board)
+    @classmethod
+    def from_file(
+        cls,
+        path: str,
+        calls: np.ndarray,
+        boards_per_shard: int = 10_000,
+        max_workers: Optional[int] = None,
+    ) -> "ShardedBingo":
+        with open(path, "r") as f:
+            return cls.from_stream(f, calls, boards_per_shard, max_workers)
+
+
+def _iter_board_shards(f: TextIO, boards_per_shard: int) -> Iterator[str]:
+    """Yields the text of `boards_per_shard` boards at a time from `f`."""
+    lines: list[str] = []
+    num_boards = 0
+    in_board = False
+    for line in f:
+        if line.strip():
+            lines.append(line)
+            in_board = True
+            continue
+
+        if in_board:  # A blank line ends a board.
+            num_boards += 1
+            in_board = False
+            if num_boards == boards_per_shard:
+                yield "".join(lines)
+                lines = []
+                num_boards = 0
+
+    if lines:
+        yield "".join(lines)
+
+
+def _evaluate_shard(shard: str, calls: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Worker: parses a shard of boards and returns the win turn and score of each board."""
+    size = len(shard.split("\n", 1)[0].split())
+    boards = np.array(shard.split(), dtype=np.int64).reshape(-1, size, size)
+    engine = BingoEngine(boards, calls)
+    return engine.win_turns, engine.scores
+
+
+# -- Tests --
+TEST_CALLS = np.array(
+    [7, 4, 9, 5, 11, 17, 23, 2, 0, 14, 21, 24, 10, 16, 13, 6, 15, 25, 12, 22, 18, 20]
+    + [8, 19, 3, 26, 1]
+)
+TEST_BOARDS = """22 13 17 11  0
+ 8  2 23  4 24
+21  9 14 16  7
+ 6 10  3 18  5
+ 1 12 20 15 19
+
+ 3 15  0  2 22
+ 9 18 13 17  5
+19  8  7 25 23
+20 11 10 24  4
+14 21 16 12  6
+
+14 21 17 24  4
+10 16 15  9 19
+18  8 23 26 20
+22 11 13  6  5
+ 2  0 12  3  7"""
+
+
+def test_bingo_engine() -> None:
+    engine = BingoEngine.from_boards(Boards.parse_input(TEST_BOARDS), TEST_CALLS)
+
+    assert engine.win_order.tolist() == [2, 0, 1]
+    assert engine.nth_to_win(1) == (2, 24)
+    assert engine.nth_to_win(3) == (1, 13)
+    assert engine.nth_to_win(4) == (-1, -1)
+    assert engine.first_to_win_score() == 4512
+    assert engine.last_to_win_score() == 1924
+
+    # Only the first 5 calls: no board has won yet.
+    engine = BingoEngine.from_boards(Boards.parse_input(TEST_BOARDS), TEST_CALLS[:5])
+    assert engine.nth_to_win(1) == (-1, -1)
+    assert engine.first_to_win_score() == -1
+
+    # Numbers called again later keep the rank of their first call.
+    calls = np.concatenate((TEST_CALLS[:3], [7, 4], TEST_CALLS[3:]))
+    engine = BingoEngine.from_boards(Boards.parse_input(TEST_BOARDS), calls)
+    assert engine.nth_to_win(1) == (2, 24)
+    assert engine.win_turns.min() == 13  # Two calls later than without the repeats.
+    assert engine.first_to_win_score() == 4512
+    assert engine.last_to_win_score() == 1924
+
+
+def test_online_bingo() -> None:
+    boards = Boards.parse_input(TEST_BOARDS)
+    engine = BingoEngine.from_boards(boards, TEST_CALLS)
+    game = OnlineBingo(boards)
+
+    events = list(game.play(iter(TEST_CALLS)))
+    assert [event.board_idx for event in events] == engine.win_order.tolist()
+    expected_turns = engine.win_turns[engine.win_order].tolist()
+    assert [event.turn for event in events] == expected_turns
+    assert [event.score for event in events] == [4512, 2192, 1924]
+    assert events[0] == WinEvent(2, 24, 11, 4512)
+
+
+def test_sharded_bingo() -> None:
+    engine = BingoEngine.from_boards(Boards.parse_input(TEST_BOARDS), TEST_CALLS)
+
+    # Repeat the boards so shards split them unevenly.
+    many_boards = "\n\n".join([TEST_BOARDS] * 5) + "\n"
+    for boards_per_shard in [1, 2, 100]:
+        sharded = ShardedBingo.from_stream(
+            io.StringIO(many_boards), TEST_CALLS, boards_per_shard, max_workers=2
+        )
+        assert len(sharded) == 15
+        assert sharded.win_turns.tolist() == engine.win_turns.tolist() * 5
+        assert sharded.nth_to_win(1) == (2, 24)
+        assert sharded.nth_to_win(2) == (5, 24)
+        assert sharded.first_to_win_score() == 4512
+        assert sharded.last_to_win_score() == 1924
 
-                if num_winning_boards >= n:
-                    return (winning_boards[0], call)
 
-        # Return trivial board if no board wins.
-        return (Board(np.zeros(shape=(5, 5))), -1)
+if __name__ == "__main__":
 
-    winning_board, winning_call = nth_to_win(boards, calls, n=1)
-    solution_a = winning_board._calculate_score(winning_call)
+    # Initialize Data.
+    with open(os.path.abspath("aoc/data/a04_boards.csv"), "r") as f:
+        data = f.read()
+
+    with open("aoc/data/a04_calls.csv", "r") as calls_f:
+        calls = np.genfromtxt(calls_f, delimiter=",", encoding="utf-8")
+
+    boards = Boards.parse_input(data)
+    engine = BingoEngine.from_boards(boards, calls)
 
-    losing_board, losing_call = nth_to_win(boards, calls, n=(num_boards - 1))
-    solution_b = losing_board._calculate_score(losing_call)
+    solution_a = engine.first_to_win_score()
+    solution_b = engine.last_to_win_score()
 
     print(f"AOC4a: {solution_a}\nAOC4b: {solution_b}")
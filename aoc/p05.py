@@ -2,6 +2,10 @@
 Code for https://adventofcode.com/2021/day/05
 """
 
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from typing import Optional
 
 import numpy as np
@@ -106,6 +110,214 @@ class Chart:
         return cls(linesegments)
 
 
+class BandedChart:
+    """Chart built by splitting the rows into bands and rasterizing each band in its own worker process.
+
+    All workers write into one chart held in shared memory; the bands never overlap, so no locking is needed.
+    """
+
+    def __init__(
+        self,
+        segments: np.ndarray,
+        chart_size: tuple[int, int] = (1_000, 1_000),
+        num_bands: Optional[int] = None,
+        max_workers: Optional[int] = None,
+    ):
+        """Rasterizes `segments` onto a chart of `chart_size`.
+
+        Parameters
+        ----------
+        segments : np.ndarray
+            (n, 4) integer array of (x1, y1, x2, y2) rows.  Lines are horizontal, vertical or 45 degree diagonals.
+        chart_size : tuple[int, int], optional
+            (rows, cols) of the chart, by default (1_000, 1_000)
+        num_bands : Optional[int], optional
+            Number of row bands to split the chart into, by default one per worker.
+        max_workers : Optional[int], optional
+            Number of worker processes, by default `os.cpu_count()`.
+        """
+        xs, ys = segments[:, [0, 2]], segments[:, [1, 3]]
+        if len(segments) and (
+            xs.min() < 0
+            or ys.min() < 0
+            or xs.max() >= chart_size[1]
+            or ys.max() >= chart_size[0]
+        ):
+            raise ValueError(f"Segments don't fit on a chart of size {chart_size}.")
+
+        self.segments = segments
+        self.chart_size = chart_size
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.num_bands = min(num_bands or self.max_workers, chart_size[0])
+        self.chart = self._plot_bands()
+
+    @property
+    def num_overlaps(self) -> int:
+        """Number of points where at least two lines overlap."""
+        return int((self.chart >= 2).sum())
+
+    def _plot_bands(self) -> np.ndarray:
+        """Rasterizes every band in the worker pool and returns a copy of the shared chart."""
+        band_edges = np.linspace(0, self.chart_size[0], self.num_bands + 1).astype(int)
+        nbytes = int(np.prod(self.chart_size)) * np.dtype(np.int32).itemsize
+
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        try:
+            chart = np.ndarray(self.chart_size, dtype=np.int32, buffer=shm.buf)
+            chart[:] = 0
+
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [
+                    executor.submit(
+                        _rasterize_band,
+                        shm.name,
+                        self.chart_size,
+                        int(row_start),
+                        int(row_stop),
+                        _clip_segments_to_band(self.segments, row_start, row_stop),
+                    )
+                    for row_start, row_stop in zip(band_edges[:-1], band_edges[1:])
+                ]
+                for future in futures:
+                    future.result()
+
+            result = chart.copy()
+            del chart  # Release the view so the buffer can be closed.
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return result
+
+    @classmethod
+    def input_parser(
+        cls,
+        data: str,
+        include_diagonals: bool = False,
+        chart_size: tuple[int, int] = (1_000, 1_000),
+        num_bands: Optional[int] = None,
+        max_workers: Optional[int] = None,
+    ) -> "BandedChart":
+        """Parses input data (same format as `Chart.input_parser`) into an (n, 4) array of segments."""
+        segments = np.array(re.findall(r"\d+", data), dtype=np.int64).reshape(-1, 4)
+        if not include_diagonals:
+            x1, y1, x2, y2 = segments.T
+            segments = segments[(x1 == x2) | (y1 == y2)]
+        return cls(segments, chart_size, num_bands, max_workers)
+
+
+def _clip_segments_to_band(
+    segments: np.ndarray, row_start: int, row_stop: int
+) -> np.ndarray:
+    """Clips `segments` to the rows [row_start, row_stop).
+
+    Returns an (m, 5) array of (x, y, x_step, y_step, num_points) rows, one for each segment crossing the band.
+    """
+    x1, y1, x2, y2 = segments.T
+    x_step = np.sign(x2 - x1)
+    y_step = np.sign(y2 - y1)
+    length = np.maximum(np.abs(x2 - x1), np.abs(y2 - y1))
+
+    # Range of steps [lo, hi] along the segment for which the y value is in the band.
+    lo = np.where(
+        y_step > 0,
+        row_start - y1,
+        np.where(y_step < 0, y1 - (row_stop - 1), 0),
+    )
+    hi = np.where(
+        y_step > 0,
+        row_stop - 1 - y1,
+        np.where(y_step < 0, y1 - row_start, length),
+    )
+    lo = np.maximum(lo, 0)
+    hi = np.minimum(hi, length)
+
+    # Horizontal lines are either entirely in the band or not at all.
+    in_band = (y_step != 0) | ((y1 >= row_start) & (y1 < row_stop))
+    keep = in_band & (hi >= lo)
+
+    return np.column_stack(
+        (x1 + lo * x_step, y1 + lo * y_step, x_step, y_step, hi - lo + 1)
+    )[keep]
+
+
+def _rasterize_band(
+    shm_name: str,
+    chart_size: tuple[int, int],
+    row_start: int,
+    row_stop: int,
+    clipped: np.ndarray,
+) -> None:
+    """Worker: adds 1 to each point of the `clipped` segments in the shared chart's band."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        chart = np.ndarray(chart_size, dtype=np.int32, buffer=shm.buf)
+        band = chart[row_start:row_stop]
+
+        # Expand each clipped segment into its points with one flat step counter.
+        num_points = clipped[:, 4]
+        steps = np.arange(num_points.sum()) - np.repeat(
+            np.cumsum(num_points) - num_points, num_points
+        )
+        xs = np.repeat(clipped[:, 0], num_points) + steps * np.repeat(
+            clipped[:, 2], num_points
+        )
+        ys = np.repeat(clipped[:, 1], num_points) + steps * np.repeat(
+            clipped[:, 3], num_points
+        )
+
+        flat_idx = (ys - row_start) * chart_size[1] + xs
+        band += np.bincount(flat_idx, minlength=band.size).reshape(band.shape)
+        del chart, band  # Release the views so the buffer can be closed.
+    finally:
+        shm.close()
+
+
+# -- Tests --
+def test_banded_chart_matches_chart() -> None:
+    test_input = "\n".join(
+        [
+            "0,9 -> 5,9",
+            "8,0 -> 0,8",
+            "9,4 -> 3,4",
+            "2,2 -> 2,1",
+            "7,0 -> 7,4",
+            "6,4 -> 2,0",
+            "0,9 -> 2,9",
+            "3,4 -> 1,4",
+            "0,0 -> 8,8",
+            "5,5 -> 8,2",
+        ]
+    )
+
+    # (include_diagonals, expected_overlaps)
+    tests: list[tuple[bool, int]] = [(False, 5), (True, 12)]
+
+    for test in tests:
+        line_segments = Chart.input_parser(test_input, test[0]).line_segments
+        expected_chart = Chart(line_segments, chart_size=(10, 10)).chart
+
+        for num_bands in [1, 3, 10]:
+            banded = BandedChart.input_parser(
+                test_input, test[0], (10, 10), num_bands=num_bands, max_workers=2
+            )
+            assert banded.num_overlaps == test[1], f"Expected {test[1]}"
+            assert (banded.chart == expected_chart).all()
+
+
+def test_banded_chart_rejects_out_of_range() -> None:
+    for test_input in [
+        "0,0 -> 12,0\n0,1 -> 3,1",
+        "0,0 -> 0,10",
+        "0,3 -> 9,3\n5,0 -> 5,11",
+    ]:
+        try:
+            BandedChart.input_parser(test_input, False, (10, 10), max_workers=1)
+        except ValueError:
+            continue
+        raise AssertionError(f"Expected ValueError for {test_input!r}.")
+
+
 if __name__ == "__main__":
 
     # Initialize Data.
@@ -2,31 +2,248 @@
 Code for https://adventofcode.com/2021/day/07
 """
 
+import io
+from typing import Callable, TextIO, Union
+
 import numpy as np
 
+FuelFunction = Callable[[np.ndarray], np.ndarray]
+
+
+def linear_fuel(distance: np.ndarray) -> np.ndarray:
+    """Fuel used to move `distance` steps when each step costs 1."""
+    return distance
+
+
+def triangular_fuel(distance: np.ndarray) -> np.ndarray:
+    """Fuel used to move `distance` steps when each step costs 1 more than the last: sum(1..distance)."""
+    return distance * (distance + 1) // 2
+
 
 def rearrange_crabs(data: np.ndarray) -> int:
-    """You quickly make a list of the horizontal position of each crab (your puzzle input). Crab submarines have limited fuel, so you need to find a way to make all of their horizontal positions match while requiring them to spend as little fuel as possible."""
-    return min(sum([abs(d - i) for d in data]) for i in range(1000))
+    """You quickly make a list of the horizontal position of each crab (your puzzle input). Crab submarines have limited fuel, so you need to find a way to make all of their horizontal positions match while requiring them to spend as little fuel as possible.
+
+    (James: The sum of absolute distances is minimized at the median.)"""
+    mid = len(data) // 2
+    median = np.partition(data, mid)[mid]
+    return int(linear_fuel(np.abs(data - median)).sum())
 
 
 def rearrange_crabs_with_dynamic_fuel(data: np.ndarray) -> int:
     """As it turns out, crab submarine engines don't burn fuel at a constant rate. Instead, each change of 1 step in horizontal position costs 1 more unit of fuel than the last: the first step costs 1, the second step costs 2, the third step costs 3, and so on.
 
-    (James: Brute force.  Nothing clever to see here, move along.)"""
+    (James: The cost is sum((d^2 + d) / 2), whose real minimum is within 1/2 of the mean, so only the few integers around the mean need checking.)"""
+    mean = int(data.sum() // len(data))
+    return min(
+        int(triangular_fuel(np.abs(data - pos)).sum())
+        for pos in range(mean - 1, mean + 3)
+    )
+
+
+def fuel_cost_curve(
+    data: np.ndarray, dynamic_fuel: bool = False
+) -> tuple[np.ndarray, np.ndarray]:
+    """Computes the total fuel cost of aligning on every position from `data.min()` to `data.max()` in O(n + range).
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Integer positions of the crabs.
+    dynamic_fuel : bool, optional
+        Use the triangular fuel cost instead of the linear one, by default False
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        (positions, costs) where `costs[i]` is the total fuel needed to align on `positions[i]`.
+    """
+    offset = int(data.min())
+    counts = np.bincount(data - offset).astype(np.int64)
+    positions = np.arange(len(counts), dtype=np.int64)
+
+    # Number of crabs and sum of their positions at or left of each position.
+    count_left = np.cumsum(counts)
+    sum_left = np.cumsum(counts * positions)
+    total_count = count_left[-1]
+    total_sum = sum_left[-1]
+
+    # sum(|x - p|) split into the crabs left of (or at) p and the ones right of p.
+    linear_costs = (positions * count_left - sum_left) + (
+        (total_sum - sum_left) - positions * (total_count - count_left)
+    )
+    if not dynamic_fuel:
+        return positions + offset, linear_costs
+
+    # sum((x - p)^2) = sum(x^2) - 2p sum(x) + n p^2, no absolute values needed.
+    total_sq_sum = int((counts * positions * positions).sum())
+    sq_costs = (
+        total_sq_sum - 2 * positions * total_sum + total_count * positions * positions
+    )
+    return positions + offset, (sq_costs + linear_costs) // 2
+
+
+class CrabHistogram:
+    """Count of crabs at each horizontal position.  Memory depends only on the range of positions, not the number of crabs."""
+
+    def __init__(self, counts: np.ndarray, offset: int = 0) -> None:
+        """Histogram of crab positions.
+
+        Parameters
+        ----------
+        counts : np.ndarray
+            `counts[i]` is the number of crabs at position `offset + i`.
+        offset : int, optional
+            Position of the first bin, by default 0
+        """
+        self.counts = counts.astype(np.int64)
+        self.offset = offset
+
+    def __len__(self) -> int:
+        """Total number of crabs."""
+        return int(self.counts.sum())
+
+    @property
+    def positions(self) -> np.ndarray:
+        return np.arange(len(self.counts), dtype=np.int64) + self.offset
+
+    def add_positions(self, positions: np.ndarray) -> None:
+        """Adds the crabs at `positions` to the histogram, growing the bins if needed."""
+        if len(positions) == 0:
+            return
+
+        if not self.counts.any():
+            self.offset = int(positions.min())
+            self.counts = np.zeros(0, dtype=np.int64)
+
+        new_offset = min(self.offset, int(positions.min()))
+        new_len = max(self.offset + len(self.counts), int(positions.max()) + 1)
+        if new_offset != self.offset or new_len - new_offset != len(self.counts):
+            grown = np.zeros(new_len - new_offset, dtype=np.int64)
+            start = self.offset - new_offset
+            grown[start : start + len(self.counts)] = self.counts
+            self.counts = grown
+            self.offset = new_offset
+
+        self.counts += np.bincount(
+            positions - self.offset, minlength=len(self.counts)
+        )
+
+    def fuel_costs(
+        self, fuel: FuelFunction = linear_fuel
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Total fuel cost of aligning on each position in the histogram's range.
+
+        The cost at position p is sum(counts[x] * fuel(|x - p|)), ie. the histogram convolved with the (symmetric) fuel kernel.
+        This is exact in integers and costs O(range^2), independent of the number of crabs.
+
+        Parameters
+        ----------
+        fuel : FuelFunction, optional
+            Vectorized fuel cost of moving a distance, by default `linear_fuel`.  (See also `triangular_fuel`.)
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            (positions, costs), see `fuel_cost_curve`.
+        """
+        size = len(self.counts)
+        distances = np.abs(np.arange(-(size - 1), size, dtype=np.int64))
+        kernel = np.asarray(fuel(distances), dtype=np.int64)
+        costs = np.convolve(self.counts, kernel)[size - 1 : 2 * size - 1]
+        return self.positions, costs
+
+    def min_fuel(self, fuel: FuelFunction = linear_fuel) -> int:
+        """Least total fuel needed for all crabs to align.  For convex `fuel` this is the bottom of the cost curve."""
+        return int(self.fuel_costs(fuel)[1].min())
+
+    def export_cost_curve(
+        self, file: Union[str, TextIO], fuel: FuelFunction = linear_fuel
+    ) -> None:
+        """Writes the cost-vs-position curve to `file` as "position,cost" CSV rows."""
+        positions, costs = self.fuel_costs(fuel)
+        np.savetxt(
+            file,
+            np.column_stack((positions, costs)),
+            fmt="%d",
+            delimiter=",",
+            header="position,cost",
+            comments="",
+        )
+
+    @classmethod
+    def from_stream(cls, f: TextIO, chunk_size: int = 1 << 20) -> "CrabHistogram":
+        """Reads comma-separated positions from `f` in chunks of `chunk_size` characters.
+
+        A position split across two chunks is carried over to the next one, so only one chunk is held in memory at a time.
+        """
+        histogram = cls(np.zeros(0, dtype=np.int64))
+        carry = ""
+        while chunk := f.read(chunk_size):
+            chunk = carry + chunk
+            last_comma = chunk.rfind(",")
+            carry = chunk[last_comma + 1 :]
+            histogram.add_positions(
+                np.fromstring(chunk[: last_comma + 1], dtype=np.int64, sep=",")
+            )
+
+        histogram.add_positions(np.fromstring(carry, dtype=np.int64, sep=","))
+        return histogram
+
+
+# -- Tests --
+def test_examples() -> None:
+    test_data = np.array([16, 1, 2, 0, 4, 2, 7, 1, 2, 14])
+
+    assert rearrange_crabs(test_data) == 37
+    assert rearrange_crabs_with_dynamic_fuel(test_data) == 168
+
+    positions, costs = fuel_cost_curve(test_data)
+    assert costs.min() == 37 and positions[costs.argmin()] == 2
+    positions, costs = fuel_cost_curve(test_data, dynamic_fuel=True)
+    assert costs.min() == 168 and positions[costs.argmin()] == 5
+
+
+def test_solvers_match_cost_curve() -> None:
+    """Positions beyond 1000 and a skewed distribution, checked against the brute-force curve."""
+    rng = np.random.default_rng(7)
+    test_data = np.concatenate(
+        [rng.integers(0, 50, size=200), rng.integers(4_000, 5_000, size=31)]
+    )
+
+    for dynamic_fuel, solver in [
+        (False, rearrange_crabs),
+        (True, rearrange_crabs_with_dynamic_fuel),
+    ]:
+        fuel = triangular_fuel if dynamic_fuel else linear_fuel
+        positions, costs = fuel_cost_curve(test_data, dynamic_fuel)
+        brute_force = [int(fuel(np.abs(test_data - p)).sum()) for p in positions]
+        assert costs.tolist() == brute_force
+        assert solver(test_data) == min(brute_force)
+
+
+def test_crab_histogram() -> None:
+    test_input = "16,1,2,0,4,2,7,1,2,14"
 
-    def calculate_dynamic_fuel_for_horiz_pos(pos: int, data: np.ndarray) -> int:
-        """Tests horizontal position where fuel costs sum(1..n) for n positions moved."""
+    for chunk_size in [1, 3, 100]:
+        histogram = CrabHistogram.from_stream(io.StringIO(test_input), chunk_size)
+        assert len(histogram) == 10
+        assert histogram.min_fuel() == 37
+        assert histogram.min_fuel(triangular_fuel) == 168
 
-        vsum_of_digits = np.vectorize(lambda n: n * (n + 1) / 2)
-        return vsum_of_digits(np.absolute(data - pos)).sum()
+        positions, costs = histogram.fuel_costs(triangular_fuel)
+        expected_positions, expected_costs = fuel_cost_curve(
+            np.array(list(map(int, test_input.split(",")))), dynamic_fuel=True
+        )
+        assert (positions == expected_positions).all()
+        assert (costs == expected_costs).all()
 
-    values = []
-    for pos in range(data.min(), data.max() + 1):
-        values.append([pos, calculate_dynamic_fuel_for_horiz_pos(pos, data)])
+    # User-supplied fuel, eg. squared distance.
+    assert histogram.min_fuel(lambda d: d * d) == 291
 
-    arr = np.array(values)
-    return int(arr[arr[:, 1].argmin()][1])
+    out = io.StringIO()
+    histogram.export_cost_curve(out, triangular_fuel)
+    lines = out.getvalue().splitlines()
+    assert lines[0] == "position,cost" and lines[6] == "5,168"
 
 
 if __name__ == "__main__":
@@ -2,24 +2,200 @@
 Code for https://adventofcode.com/2021/day/16
 """
 
+import hashlib
+import io
 import math
-from typing import Any
+from array import array
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Optional, TextIO, Union
+
+LITERAL_TYPE_ID = 4
+
+# Value and version sum of one top-level packet, see `stream_packets`.
+PacketResult = namedtuple("PacketResult", ("value", "version_sum"))
+
+# Operator type_id -> function of the list of subpacket values.
+OPERATORS: dict[int, Callable[[list[int]], int]] = {
+    0: sum,
+    1: math.prod,
+    2: min,
+    3: max,
+    5: lambda values: int(values[0] > values[1]),
+    6: lambda values: int(values[0] < values[1]),
+    7: lambda values: int(values[0] == values[1]),
+}
+
+
+class BitReader:
+    """Reads big-endian bit fields from a bytes buffer.
+
+    Bits are pulled from `data` into a small int buffer a window of bytes at a time, so each read is a few small-int
+    operations regardless of how long the transmission is.  Only a refill checks for the end of the data.
+    """
+
+    WINDOW = 32  # Bytes loaded into the buffer per refill.
+
+    def __init__(self, data: bytes, num_bits: Optional[int] = None) -> None:
+        """Bit reader.
+
+        Parameters
+        ----------
+        data : bytes
+            The raw bytes to read.
+        num_bits : Optional[int], optional
+            Number of valid bits in `data`, by default all of them.
+        """
+        self.num_bits = len(data) * 8 if num_bits is None else num_bits
+        self.data = bytes(data[: (self.num_bits + 7) // 8])
+        # Bits of the last byte beyond `num_bits`, dropped when it's loaded.
+        self._excess_bits = len(self.data) * 8 - self.num_bits
+
+        self._byte_pos = 0  # Next byte of `data` to load into the buffer.
+        self._bits_loaded = 0
+        self._buffer = 0
+        self._buffer_bits = 0
+
+        # Position just after the last 1 bit.  Anything from here on is zero padding.
+        stripped_len = len(data.rstrip(b"\x00"))
+        if stripped_len == 0:
+            self.end = 0
+        else:
+            last_byte = data[stripped_len - 1]
+            trailing_zeros = (last_byte & -last_byte).bit_length() - 1
+            self.end = min(stripped_len * 8 - trailing_zeros, self.num_bits)
+
+    @property
+    def cursor(self) -> int:
+        """Number of bits read so far."""
+        return self._bits_loaded - self._buffer_bits
+
+    def read(self, n: int) -> int:
+        """Reads the next `n` bits as an unsigned int and moves the cursor past them."""
+        # Bits above the unread ones are left in the buffer, and masked off here instead.
+        bits = self._buffer_bits - n
+        if bits < 0:
+            bits = self._refill(n) - n
+        self._buffer_bits = bits
+        return (self._buffer >> bits) & ((1 << n) - 1)
+
+    def _refill(self, n: int) -> int:
+        """Loads windows of `data` until at least `n` bits are buffered.  Returns the number of buffered bits."""
+        data, pos = self.data, self._byte_pos
+        bits, loaded = self._buffer_bits, self._bits_loaded
+        buffer = self._buffer & ((1 << bits) - 1)
+        while bits < n:
+            window = data[pos : pos + self.WINDOW]
+            if not window:
+                raise ValueError(
+                    f"Can't read {n} bits at {loaded - bits}, only {self.num_bits} bits available."
+                )
+            pos += len(window)
+            new_bits = 8 * len(window)
+            buffer = (buffer << new_bits) | int.from_bytes(window, "big")
+            if pos == len(data) and self._excess_bits:
+                buffer >>= self._excess_bits
+                new_bits -= self._excess_bits
+            bits += new_bits
+            loaded += new_bits
+
+        self._byte_pos, self._buffer, self._bits_loaded = pos, buffer, loaded
+        return bits
+
+    def only_padding_left(self) -> bool:
+        """True if every bit from the cursor on is a zero (end padding)."""
+        return self.cursor >= self.end
+
+
+class HexStreamReader:
+    """Reads big-endian bit fields from hex text arriving through a file-like object.
+
+    Same interface as `BitReader`, but the hex is read and decoded `chunk_size` characters at a time, and only the
+    current chunk plus a small buffer of unread bits is held in memory.
+    """
+
+    def __init__(self, f: TextIO, chunk_size: int = 1 << 16) -> None:
+        self.f = f
+        self.chunk_size = chunk_size
+
+        self._data = b""  # Current decoded chunk.
+        self._byte_pos = 0
+        self._bytes_loaded = 0  # Bytes moved into the buffer so far.
+        self._odd_digit = ""  # Hex digit left over from an odd-length chunk.
+
+        self._buffer = 0
+        self._buffer_bits = 0
+
+    @property
+    def cursor(self) -> int:
+        """Number of bits read so far."""
+        return self._bytes_loaded * 8 - self._buffer_bits
+
+    def read(self, n: int) -> int:
+        """Reads the next `n` bits as an unsigned int and moves the cursor past them."""
+        while self._buffer_bits < n:
+            if not self._refill():
+                raise ValueError(
+                    f"Can't read {n} bits at {self.cursor}, the transmission ended."
+                )
+
+        self._buffer_bits -= n
+        value = self._buffer >> self._buffer_bits
+        self._buffer &= (1 << self._buffer_bits) - 1
+        return value
+
+    def only_padding_left(self) -> bool:
+        """True if every bit from the cursor to the end of the stream is a zero (end padding)."""
+        while self._buffer == 0:
+            if not self._refill():
+                return True
+        return False
+
+    def _refill(self) -> bool:
+        """Moves up to 64 more bits into the buffer.  Returns False at the end of the stream."""
+        if self._byte_pos >= len(self._data) and not self._next_chunk():
+            return False
+
+        chunk = self._data[self._byte_pos : self._byte_pos + 8]
+        self._buffer = (self._buffer << (8 * len(chunk))) | int.from_bytes(chunk, "big")
+        self._buffer_bits += 8 * len(chunk)
+        self._byte_pos += len(chunk)
+        self._bytes_loaded += len(chunk)
+        return True
+
+    def _next_chunk(self) -> bool:
+        """Decodes the next chunk of hex from `f`.  Returns False at the end of the stream."""
+        while True:
+            text = self.f.read(self.chunk_size)
+            if not text:
+                if not self._odd_digit:
+                    return False
+                hex_digits = (
+                    self._odd_digit + "0"
+                )  # Pad the last digit to a whole byte.
+                self._odd_digit = ""
+            else:
+                hex_digits = self._odd_digit + "".join(text.split())
+                self._odd_digit = ""
+                if len(hex_digits) % 2:
+                    hex_digits, self._odd_digit = hex_digits[:-1], hex_digits[-1]
 
-# Hex string to binary (0-padded 4-digit) string.
-HEX_TO_BIN_STR = {f"{i:0X}": f"{i:04b}" for i in range(16)}
+            if hex_digits:
+                self._data = bytes.fromhex(hex_digits)
+                self._byte_pos = 0
+                return True
 
 
 class Packet:
     """Class representation of Packet object."""
 
-    def __init__(self, decoded_packet: str) -> None:
-        self.packet = decoded_packet
+    def __init__(self, reader: BitReader) -> None:
+        self.reader = reader
         self.packet_values: list[Any] = []
-        self.cursor = 0
         self.version_sum = 0  # For use in the problem.
 
     def parse(self) -> None:
-        while "1" in self.packet[self.cursor :]:  # Not end-padded zeros.
+        while not self.reader.only_padding_left():  # Not end-padded zeros.
             self.packet_values.append(self._next_packet())
 
     def _next_packet(self) -> Any:
@@ -27,50 +203,44 @@ class Packet:
         if type_id == 4:
             return self._parse_literal_value()
         else:
-            length_type_bit = int(self._read_n_digits_and_update_cursor(1))
+            length_type_bit = self.reader.read(1)
             if length_type_bit == 0:
                 return self._parse_length_type_0_operator(type_id)
             else:
                 return self._parse_length_type_1_operator(type_id)
 
     def _read_version_and_type_id(self) -> tuple[int, int]:
-        """Reads the version, increments the cursor, and adds to the version sum.  Returns dict with "version" and "type_id" as keys."""
+        """Reads the version and type_id, increments the cursor, and adds to the version sum."""
 
-        version = int(self._read_n_digits_and_update_cursor(3), 2)
-        type_id = int(self._read_n_digits_and_update_cursor(3), 2)
+        version = self.reader.read(3)
+        type_id = self.reader.read(3)
         self.version_sum += version
 
         return (version, type_id)
 
-    def _read_n_digits_and_update_cursor(self, n: int) -> str:
-        """Reads and returns a string of n-digits at the current cursor position."""
-        digits = self.packet[self.cursor : self.cursor + n]
-        self.cursor += n
-        return digits
-
     def _parse_literal_value(self) -> int:
         """Gets literal value of type_id == 4 packet."""
 
-        contents = ""
+        value = 0
         packet_complete = False
         while not packet_complete:
-            if self.packet[self.cursor] == "0":
-                packet_complete = True
-            contents += self._read_n_digits_and_update_cursor(n=5)[1:]
-        return int(contents, 2)
+            group = self.reader.read(5)
+            packet_complete = not group & 0b10000
+            value = (value << 4) | (group & 0b1111)
+        return value
 
     def _parse_length_type_0_operator(self, type_id: int) -> int:
         """Parse Lenght_Type 0 Operators."""
-        subpacket_len = int(self._read_n_digits_and_update_cursor(15), 2)
-        current_cursor_pos = self.cursor
+        subpacket_len = self.reader.read(15)
+        current_cursor_pos = self.reader.cursor
         values = []
-        while self.cursor < current_cursor_pos + subpacket_len:
+        while self.reader.cursor < current_cursor_pos + subpacket_len:
             values.append(self._next_packet())
         return self._parse_values_for_operator_type_id(type_id, values)
 
     def _parse_length_type_1_operator(self, type_id: int) -> int:
         """Parse Lenght_Type 1 Operators."""
-        subpacket_num = int(self._read_n_digits_and_update_cursor(11), 2)
+        subpacket_num = self.reader.read(11)
         values = [self._next_packet() for _ in range(subpacket_num)]
         return self._parse_values_for_operator_type_id(type_id, values)
 
@@ -78,27 +248,250 @@ class Packet:
         self, type_id: int, values: list[int]
     ) -> int:
         """Given a list of values, produce the correct output for operator the corresponding type_id."""
-        if type_id == 0:
-            return sum(values)
-        elif type_id == 1:
-            return math.prod(values)
-        elif type_id == 2:
-            return min(values)
-        elif type_id == 3:
-            return max(values)
-        elif type_id == 5:
-            return int(values[0] > values[1])
-        elif type_id == 6:
-            return int(values[0] < values[1])
-        elif type_id == 7:
-            return int(values[0] == values[1])
-        else:
+        if type_id not in OPERATORS:
             return -1
+        return OPERATORS[type_id](values)
 
     @classmethod
     def decode_packet(cls, encoded_packet: str) -> "Packet":
-        decoded_packet = "".join([HEX_TO_BIN_STR[s] for s in encoded_packet])
-        return cls(decoded_packet)
+        encoded_packet = encoded_packet.strip()
+        num_bits = 4 * len(encoded_packet)
+        if len(encoded_packet) % 2:  # bytes.fromhex needs whole bytes.
+            encoded_packet += "0"
+        return cls(BitReader(bytes.fromhex(encoded_packet), num_bits))
+
+
+class PacketTree:
+    """
+    Flat, array-based syntax tree of every packet in a transmission, parsed once and evaluated separately.
+
+    Packets are stored in the order they appear (parents before their children).  Node `i` has `type_ids[i]`,
+    `versions[i]`, `literals[i]` (0 for operators) and its children are
+    `children[child_starts[i] : child_starts[i] + child_counts[i]]`.  `roots` holds the top-level packets.
+    """
+
+    def __init__(self) -> None:
+        self.type_ids = array("B")
+        self.versions = array("B")
+        self.literals: list[int] = []  # Literals can be arbitrarily large.
+        self.child_starts = array("q")
+        self.child_counts = array("q")
+        self.children = array("q")
+        self.roots: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self.type_ids)
+
+    def version_sum(self) -> int:
+        return sum(self.versions)
+
+    def evaluate(self) -> list[int]:
+        """Returns the value of every packet.  Children come after their parents, so a reverse pass sees them first."""
+        results = [0] * len(self)
+        for idx in range(len(self) - 1, -1, -1):
+            type_id = self.type_ids[idx]
+            if type_id == LITERAL_TYPE_ID:
+                results[idx] = self.literals[idx]
+                continue
+
+            start = self.child_starts[idx]
+            child_values = [
+                results[child]
+                for child in self.children[start : start + self.child_counts[idx]]
+            ]
+            results[idx] = (
+                OPERATORS[type_id](child_values) if type_id in OPERATORS else -1
+            )
+
+        return results
+
+    def root_values(self) -> list[int]:
+        """Values of the top-level packets."""
+        results = self.evaluate()
+        return [results[root] for root in self.roots]
+
+    def _add_node(self, version: int, type_id: int, literal: int = 0) -> int:
+        self.versions.append(version)
+        self.type_ids.append(type_id)
+        self.literals.append(literal)
+        self.child_starts.append(0)
+        self.child_counts.append(0)
+        return len(self.type_ids) - 1
+
+    def _set_children(self, node: int, children: list[int]) -> None:
+        self.child_starts[node] = len(self.children)
+        self.child_counts[node] = len(children)
+        self.children.extend(children)
+
+    @classmethod
+    def parse(
+        cls,
+        reader: Union[BitReader, HexStreamReader],
+        max_packets: Optional[int] = None,
+    ) -> "PacketTree":
+        """Parses the packets left in `reader` (up to `max_packets` top-level ones) with an explicit stack instead of recursion, so nesting depth isn't limited."""
+        tree = cls()
+
+        # Open operators: [node, length_type, end cursor or number of subpackets, children so far].
+        stack: list[list[Any]] = []
+        while stack or (
+            (max_packets is None or len(tree.roots) < max_packets)
+            and not reader.only_padding_left()
+        ):
+            # Close every operator whose subpackets are all parsed.
+            if stack:
+                node, length_type, limit, children = stack[-1]
+                done = (
+                    reader.cursor >= limit
+                    if length_type == 0
+                    else len(children) == limit
+                )
+                if done:
+                    stack.pop()
+                    tree._set_children(node, children)
+                    if stack:
+                        stack[-1][3].append(node)
+                    else:
+                        tree.roots.append(node)
+                    continue
+
+            version = reader.read(3)
+            type_id = reader.read(3)
+
+            if type_id == LITERAL_TYPE_ID:
+                literal = 0
+                group = 0b10000
+                while group & 0b10000:
+                    group = reader.read(5)
+                    literal = (literal << 4) | (group & 0b1111)
+
+                node = tree._add_node(version, type_id, literal)
+                if stack:
+                    stack[-1][3].append(node)
+                else:
+                    tree.roots.append(node)
+
+            else:
+                node = tree._add_node(version, type_id)
+                if reader.read(1) == 0:
+                    subpacket_len = reader.read(15)
+                    stack.append([node, 0, reader.cursor + subpacket_len, []])
+                else:
+                    stack.append([node, 1, reader.read(11), []])
+
+        return tree
+
+    @classmethod
+    def decode(cls, encoded_packet: str) -> "PacketTree":
+        return cls.parse(Packet.decode_packet(encoded_packet).reader)
+
+
+def stream_packets(f: TextIO, chunk_size: int = 1 << 16) -> Iterator[PacketResult]:
+    """Decodes hex from `f` in chunks, yielding each top-level packet's value and version sum as soon as it's complete.
+
+    Only one top-level packet's tree is held at a time, so memory doesn't grow with the number of packets.
+    """
+    reader = HexStreamReader(f, chunk_size)
+    while not reader.only_padding_left():
+        tree = PacketTree.parse(reader, max_packets=1)
+        yield PacketResult(tree.root_values()[0], tree.version_sum())
+
+
+def decode_transmission(encoded_packet: str) -> PacketResult:
+    """Value of the (first) top-level packet and the version sum of the whole transmission."""
+    tree = PacketTree.decode(encoded_packet)
+    return PacketResult(tree.root_values()[0], tree.version_sum())
+
+
+class BatchDecoder:
+    """
+    Decodes many independent transmissions across a process pool.  An LRU cache of results, keyed by a hash of the
+    payload and holding at most `cache_size` entries, sits in front of the pool so repeated payloads aren't decoded again.
+    """
+
+    def __init__(
+        self, cache_size: int = 4096, max_workers: Optional[int] = None
+    ) -> None:
+        self.cache_size = cache_size
+        self.max_workers = max_workers
+        self.cache: OrderedDict[bytes, PacketResult] = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self) -> "BatchDecoder":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Shuts down the worker pool (it's started again if needed)."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def decode(
+        self, payloads: Iterable[str], chunksize: int = 64
+    ) -> list[PacketResult]:
+        """Decodes every hex payload, returns the results in the same order.
+
+        Parameters
+        ----------
+        payloads : Iterable[str]
+            Hex transmissions.
+        chunksize : int, optional
+            Number of payloads sent to a worker at a time, by default 64
+
+        Returns
+        -------
+        list[PacketResult]
+            Value and version sum for each payload.
+        """
+        payloads = [payload.strip().upper() for payload in payloads]
+        keys = [
+            hashlib.blake2b(payload.encode(), digest_size=16).digest()
+            for payload in payloads
+        ]
+
+        # Payloads to decode: not cached, and only the first copy of any repeats in this batch.
+        to_decode: dict[bytes, str] = {}
+        for key, payload in zip(keys, payloads):
+            if key not in self.cache and key not in to_decode:
+                to_decode[key] = payload
+
+        decoded: dict[bytes, PacketResult] = {}
+        if to_decode:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            new_results = self._executor.map(
+                decode_transmission, to_decode.values(), chunksize=chunksize
+            )
+            decoded = dict(zip(to_decode.keys(), new_results))
+
+        # Resolve every payload before touching the cache: caching a new result can evict an
+        # entry that a later payload in this batch was counted as a hit for.
+        results: dict[bytes, PacketResult] = {}
+        for key in keys:
+            if key in results:
+                self.cache_hits += 1
+            elif key in self.cache:
+                self.cache_hits += 1
+                results[key] = self.cache[key]
+            else:
+                self.cache_misses += 1
+                results[key] = decoded[key]
+
+        for key in keys:
+            self._cache_result(key, results[key])
+
+        return [results[key] for key in keys]
+
+    def _cache_result(self, key: bytes, result: PacketResult) -> None:
+        self.cache[key] = result
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
 
 
 # -- Testing --
@@ -172,6 +565,137 @@ def test_operator_specifics() -> None:
         ), f"Expected {test[1]}, got {test_packet.packet_values[0]}"
 
 
+def test_bit_reader() -> None:
+    reader = BitReader(bytes.fromhex("D2FE28"))
+    assert [reader.read(3), reader.read(3)] == [6, 4]
+    assert [reader.read(5) for _ in range(3)] == [0b10111, 0b11110, 0b00101]
+    assert reader.cursor == 21 and reader.only_padding_left()
+
+    # Two literal packets (2021 then 10) back to back with no padding between them.
+    bits = "110100101111111000101" + "010100" + "01010"
+    bits += "0" * (-len(bits) % 8)
+    test_packet = Packet(BitReader(int(bits, 2).to_bytes(len(bits) // 8, "big")))
+    test_packet.parse()
+    assert test_packet.packet_values == [2021, 10]
+    assert test_packet.version_sum == 8
+
+    # Reads crossing refill windows, and a bit count that isn't a whole number of bytes.
+    data = bytes(range(200))
+    bits = "".join(f"{byte:08b}" for byte in data)[:1599]
+    reader = BitReader(data, num_bits=1599)
+    widths = [1, 3, 5, 11, 15, 7] * 200
+    cursor = 0
+    for width in widths:
+        if cursor + width > 1599:
+            break
+        assert reader.read(width) == int(bits[cursor : cursor + width], 2)
+        cursor += width
+        assert reader.cursor == cursor
+
+    # Reading past the end raises and leaves the cursor where it was.
+    try:
+        reader.read(1599 - cursor + 1)
+        assert False, "Expected ValueError"
+    except ValueError:
+        pass
+    assert reader.cursor == cursor
+    assert reader.read(1599 - cursor) == int(bits[cursor:], 2)
+
+
+def test_packet_tree() -> None:
+    tests = [
+        ("D2FE28", 2021),
+        ("C200B40A82", 3),
+        ("04005AC33890", 54),
+        ("880086C3E88112", 7),
+        ("CE00C43D881120", 9),
+        ("D8005AC2A8F0", 1),
+        ("F600BC2D8F", 0),
+        ("9C005AC2F8F0", 0),
+        ("9C0141080250320F1802104A08", 1),
+        ("8A004A801A8002F478", 15),
+    ]
+    for test in tests:
+        tree = PacketTree.decode(test[0])
+        test_packet = Packet.decode_packet(test[0])
+        test_packet.parse()
+
+        assert tree.root_values() == [
+            test[1]
+        ], f"Expected {test[1]}, got {tree.root_values()}"
+        assert tree.version_sum() == test_packet.version_sum
+
+    tree = PacketTree.decode("38006F45291200")
+    assert tree.evaluate() == [1, 10, 20]  # 10 < 20
+    assert list(tree.children) == [1, 2]
+
+
+def test_packet_tree_deep_nesting() -> None:
+    """A sum nested far deeper than the recursion limit."""
+    depth = 5_000
+    bits = "000000" + "1" + f"{1:011b}"  # Version 0 sum with 1 subpacket.
+    literal = "001100" + "00111"  # Version 1 literal 7.
+    transmission = bits * depth + literal
+    transmission += "0" * (-len(transmission) % 8)
+
+    reader = BitReader(int(transmission, 2).to_bytes(len(transmission) // 8, "big"))
+    tree = PacketTree.parse(reader)
+    assert len(tree) == depth + 1
+    assert tree.root_values() == [7]
+    assert tree.version_sum() == 1
+
+
+def test_stream_packets() -> None:
+    # Three top-level packets back to back (3, 54 and 2021), with the padding after each one removed.
+    bits = ""
+    expected = []
+    for packet_hex in ["C200B40A82", "04005AC33890", "D2FE28"]:
+        reader = BitReader(bytes.fromhex(packet_hex))
+        tree = PacketTree.parse(reader, max_packets=1)
+        bits += f"{int(packet_hex, 16):0{4 * len(packet_hex)}b}"[: reader.cursor]
+        expected.append(PacketResult(tree.root_values()[0], tree.version_sum()))
+    bits += "0" * (-len(bits) % 4)
+    hex_str = f"{int(bits, 2):0{len(bits) // 4}X}"
+
+    assert [result.value for result in expected] == [3, 54, 2021]
+    for chunk_size in [1, 3, 1000]:
+        results = list(stream_packets(io.StringIO(hex_str + "\n"), chunk_size))
+        assert results == expected, f"Expected {expected}, got {results}"
+
+    tree = PacketTree.decode(hex_str)
+    assert tree.root_values() == [3, 54, 2021]
+
+
+def test_batch_decoder() -> None:
+    payloads = ["C200B40A82", "04005AC33890", "880086C3E88112", "c200b40a82", "D2FE28"]
+    expected = [decode_transmission(payload) for payload in payloads]
+    assert [result.value for result in expected] == [3, 54, 7, 3, 2021]
+
+    with BatchDecoder(cache_size=3, max_workers=2) as decoder:
+        # The lower-case repeat is only decoded once.
+        assert decoder.decode(payloads, chunksize=2) == expected
+        assert decoder.cache_misses == 4 and decoder.cache_hits == 1
+        assert len(decoder.cache) == 3
+
+        # Still cached: the three most recently used payloads.
+        assert decoder.decode(["D2FE28", "880086C3E88112"]) == [
+            expected[4],
+            expected[2],
+        ]
+        assert decoder.cache_hits == 3
+
+        # "04005AC33890" was evicted, so it's decoded again.
+        assert decoder.decode(["04005AC33890"]) == [expected[1]]
+        assert decoder.cache_misses == 5
+
+    # A cached payload evicted part way through a batch is still returned.
+    with BatchDecoder(cache_size=1, max_workers=2) as decoder:
+        assert decoder.decode(["D2FE28"]) == [expected[4]]
+        assert decoder.decode(["C200B40A82", "D2FE28"]) == [expected[0], expected[4]]
+        assert decoder.cache_misses == 2 and decoder.cache_hits == 1
+        assert list(decoder.cache.values()) == [expected[4]]
+
+
 # test_literal_packet()
 # test_operator_0_packet()
 # test_operator_1_packet()
@@ -184,9 +708,8 @@ if __name__ == "__main__":
     with open("./aoc/data/a16.csv", "r") as f:
         data = f.read()
 
-    packet = Packet.decode_packet(data)
-    packet.parse()
-    solution_a = packet.version_sum
-    solution_b = packet.packet_values[0]
+    tree = PacketTree.decode(data)
+    solution_a = tree.version_sum()
+    solution_b = tree.root_values()[0]
 
     print(f"AOC16a: {solution_a}\nAOC16b: {solution_b}")
@@ -2,8 +2,10 @@
 Code for https://adventofcode.com/2021/day/17
 """
 
+import math
 import re
 from collections import namedtuple
+from typing import Optional
 
 import numpy as np
 
@@ -25,7 +27,13 @@ class ProbeLauncher:
     - Due to gravity, the probe's y velocity decreases by 1.
     """
 
-    def __init__(self, x_vel: int, y_vel: int, target_zone: TargetZone) -> None:
+    def __init__(
+        self,
+        x_vel: int,
+        y_vel: int,
+        target_zone: TargetZone,
+        keep_history: bool = True,
+    ) -> None:
         """Class for Probe Launcher.
 
         Parameters
@@ -36,55 +44,74 @@ class ProbeLauncher:
             The initial value for velocity in the y-direction.
         target_zone : tuple[int, int, int, int]
             (x_min, x_max, y_min, y_max) for the desired target zone.
+        keep_history : bool, optional
+            Keep every position in `positions` (needed for the `__repr__` picture), by default True.
+            Without it, only the highest y and whether the target was hit are tracked, and
+            `step_until_out_of_range` stops as soon as the target is hit.
         """
 
         self.x_vel = x_vel
         self.y_vel = y_vel
         self.target_zone = target_zone
+        self.keep_history = keep_history
 
         # Keep track of all launched probe positions per step.
         self.current_pos = Position(0, 0)
         self.positions = [self.current_pos]
 
+        # Running values for when there's no history.
+        self._highest_y = self.current_pos.y
+        self._hit_target = self._is_in_target_zone(self.current_pos)
+
     @property
     def highest_y_position(self) -> int:
         """Returns the maximum value of y that the probe has reached thus far.  (For the problem solution.)"""
+        if not self.keep_history:
+            return self._highest_y
         return max(pos.y for pos in self.positions)
 
     def step(self) -> None:
         new_x = self.current_pos.x + self.x_vel
         new_y = self.current_pos.y + self.y_vel
         self.current_pos = Position(new_x, new_y)
-        self.positions.append(self.current_pos)
-
-        # Reduce velocities by 1 due to drag/gravity.
-        self.x_vel = max(0, self.x_vel - 1)
+        if self.keep_history:
+            self.positions.append(self.current_pos)
+        else:
+            self._highest_y = max(self._highest_y, new_y)
+            self._hit_target = self._hit_target or self._is_in_target_zone(
+                self.current_pos
+            )
+
+        # Reduce velocities by 1 due to drag (towards 0) and gravity.
+        self.x_vel -= (self.x_vel > 0) - (self.x_vel < 0)
         self.y_vel -= 1
 
+    def _can_still_hit(self) -> bool:
+        """False once the probe is past the target in x and not heading back, or below it and falling."""
+        pos, zone = self.current_pos, self.target_zone
+        if pos.x > zone.xmax and self.x_vel >= 0:
+            return False
+        if pos.x < zone.xmin and self.x_vel <= 0:
+            return False
+        if pos.y < zone.ymin and self.y_vel < 0:
+            return False
+        return True
+
     def step_until_out_of_range(self) -> None:
-        """Steps until the probe is out of range for the target."""
+        """Steps until the probe is out of range for the target (or, without a history, until it hits it)."""
 
         while True:
-            # If we overshot it and it's
-            if self.current_pos.x > self.target_zone.xmax:
+            # Without a history there's nothing more to record once we've hit,
+            # except the top of the arc if we're still going up.
+            if not self.keep_history and self._hit_target:
+                if self.y_vel > 0:
+                    self._highest_y = max(
+                        self._highest_y,
+                        self.current_pos.y + self.y_vel * (self.y_vel + 1) // 2,
+                    )
                 break
 
-            # If we're free-falling...
-            if self.x_vel == 0:
-
-                # If we're not in the x-range to get there.
-                if (
-                    self.current_pos.x < self.target_zone.xmin
-                    or self.current_pos.x > self.target_zone.xmax
-                ):
-                    break
-
-                # If we're below it...
-                if self.current_pos.y < self.target_zone.ymin:
-                    break
-
-            # If we're falling and below the min y value.
-            if self.y_vel < 0 and self.current_pos.y < self.target_zone.ymin:
+            if not self._can_still_hit():
                 break
 
             self.step()
@@ -100,12 +127,19 @@ class ProbeLauncher:
 
     def has_hit_target(self) -> bool:
         """Checks all positions in `positions` to see if any have hit the `target_zone`."""
-
+        if not self.keep_history:
+            return self._hit_target
         return any(self._is_in_target_zone(pos) for pos in self.positions)
 
     def __repr__(self) -> str:
         """Graphs a representation of the arc.
         Note: This is kind'a gross, just wanted to make an 'okay' picture."""
+        if not self.keep_history:
+            return (
+                f"ProbeLauncher(position={self.current_pos}, highest_y={self._highest_y}, "
+                f"hit_target={self._hit_target})"
+            )
+
         max_x_val = max(max(p.x for p in self.positions), self.target_zone.xmax)
         y_span = max(
             abs(max(p.y for p in self.positions))
@@ -129,13 +163,289 @@ class ProbeLauncher:
         return "\n".join(" ".join(symbol_map[r] for r in row) for row in grid)
 
     @classmethod
-    def parse_input(cls, input_data: str, x_vel: int, y_vel: int) -> "ProbeLauncher":
+    def parse_input(
+        cls, input_data: str, x_vel: int, y_vel: int, keep_history: bool = True
+    ) -> "ProbeLauncher":
         """Parses input which looks like into an appropriate target area, returns `ProbeLauncher` obj with associated `x_vel, y_vel`."""
+        return cls(x_vel, y_vel, parse_target_zone(input_data), keep_history)
+
+
+def parse_target_zone(input_data: str) -> TargetZone:
+    """Parses input which looks like "target area: x=20..30, y=-10..-5" into a `TargetZone`."""
+    pattern = re.compile(r"[xy]=(-?\d+)\.\.(-?\d+),?")
+    x, y = re.findall(pattern, input_data)
+    return TargetZone(int(x[0]), int(x[1]), int(y[0]), int(y[1]))
+
+
+# -- Analytic Solver --
+# After t steps, with c = t(t-1)/2:
+#   y = t * y_vel - c
+#   x = t * x_vel - c  while the probe still moves (x_vel >= t), else the stopping point x_vel(x_vel+1)/2.
+# So for each step count, the velocities landing in the target are (at most two) ranges we can write down directly.
+
+
+def _ceil_div(a: int, b: int) -> int:
+    return -(-a // b)
+
+
+def _triangular(n: int) -> int:
+    return n * (n + 1) // 2
+
+
+def _min_stop_vel(dist: int) -> int:
+    """Smallest velocity v >= 0 which stops (after drag) at least `dist` away, ie. v(v+1)/2 >= dist."""
+    if dist <= 0:
+        return 0
+    vel = (math.isqrt(8 * dist + 1) - 1) // 2
+    return vel if _triangular(vel) >= dist else vel + 1
+
+
+def _max_stop_vel(dist: int) -> int:
+    """Largest velocity v >= 0 which stops at most `dist` away, ie. v(v+1)/2 <= dist.  -1 if there's none."""
+    if dist < 0:
+        return -1
+    return (math.isqrt(8 * dist + 1) - 1) // 2
+
+
+def _forward_vel_ranges(step: int, lo: int, hi: int) -> list[tuple[int, int]]:
+    """Ranges of x velocities v >= 0 with x in [lo, hi] (0 <= lo) after `step` steps."""
+    offset = step * (step - 1) // 2
+    ranges = []
+
+    # Still moving: v >= step.
+    moving_lo = max(_ceil_div(lo + offset, step), step)
+    moving_hi = (hi + offset) // step
+    if moving_lo <= moving_hi:
+        ranges.append((moving_lo, moving_hi))
+
+    # Already stopped: v < step.
+    stopped_lo = _min_stop_vel(lo)
+    stopped_hi = min(_max_stop_vel(hi), step - 1)
+    if stopped_lo <= stopped_hi:
+        ranges.append((stopped_lo, stopped_hi))
+
+    return ranges
+
+
+def _x_vel_ranges(step: int, target_zone: TargetZone) -> list[tuple[int, int]]:
+    """Ranges of x velocities (of either sign) with x in the target zone after `step` steps."""
+    ranges = []
+    if target_zone.xmax >= 0:
+        ranges += _forward_vel_ranges(step, max(target_zone.xmin, 0), target_zone.xmax)
+    if target_zone.xmin < 0:
+        # Mirror the zone behind the launcher; 0 was already covered above.
+        for vel_lo, vel_hi in _forward_vel_ranges(
+            step, max(-target_zone.xmax, 0), -target_zone.xmin
+        ):
+            if vel_hi >= max(vel_lo, 1):
+                ranges.append((-vel_hi, -max(vel_lo, 1)))
+    return ranges
+
+
+def _y_vel_range(step: int, target_zone: TargetZone) -> tuple[int, int]:
+    """Range of y velocities with y in the target zone after `step` steps (empty if lo > hi)."""
+    offset = step * (step - 1) // 2
+    return (
+        _ceil_div(target_zone.ymin + offset, step),
+        (target_zone.ymax + offset) // step,
+    )
+
+
+def _max_useful_step(target_zone: TargetZone) -> Optional[int]:
+    """Number of steps after which no probe can land in the target for the first time.  None if there isn't one."""
+    max_steps = []
+
+    # y: a zone below the launcher is passed for good after -2 * ymin steps, one above after 2 * ymax + 1.
+    if target_zone.ymax < 0:
+        max_steps.append(-2 * target_zone.ymin)
+    elif target_zone.ymin > 0:
+        max_steps.append(2 * target_zone.ymax + 1)
+
+    # x: if no probe can stop inside the x-range, a moving probe needs step(step+1)/2 <= max |x| to be there.
+    can_stop_inside = any(
+        _min_stop_vel(max(lo, 0)) <= _max_stop_vel(hi)
+        for lo, hi in [
+            (target_zone.xmin, target_zone.xmax),
+            (-target_zone.xmax, -target_zone.xmin),
+        ]
+        if hi >= 0
+    )
+    if not can_stop_inside:
+        max_steps.append(
+            _max_stop_vel(max(abs(target_zone.xmin), abs(target_zone.xmax)))
+        )
+
+    return min(max_steps) if max_steps else None
+
+
+def solve_velocities(target_zone: TargetZone) -> tuple[tuple[int, int], int, int]:
+    """Finds every initial velocity that hits `target_zone` from the closed-form kinematics, no simulation or search bounds.
+
+    For each step count, the x and y velocities that put the probe in the target at that step are ranges, and the
+    velocities that hit are the union over step counts of those ranges' products.  The hits are counted by merging
+    the y ranges of each x velocity, without listing them.
+
+    Parameters
+    ----------
+    target_zone : TargetZone
+        The target, anywhere relative to the launcher (except containing it).
+
+    Returns
+    -------
+    tuple[tuple[int, int], int, int]
+        ((xvel, yvel), max_y_attained, number_of_vels_that_hit).  ((-9999, -9999), -9999, 0) if nothing hits.
+
+    Raises
+    ------
+    ValueError
+        If infinitely many velocities hit the target.
+    """
+    max_step = _max_useful_step(target_zone)
+    if max_step is None:
+        raise ValueError(f"Infinitely many velocities hit {target_zone}.")
+
+    # Every (step, x velocity) where the probe is in the x-range, with that step's y velocity range.
+    x_vel_los, x_vel_counts, y_vel_los, y_vel_his = [], [], [], []
+    for step in range(1, max_step + 1):
+        y_vel_lo, y_vel_hi = _y_vel_range(step, target_zone)
+        if y_vel_lo > y_vel_hi:
+            continue
+        for x_vel_lo, x_vel_hi in _x_vel_ranges(step, target_zone):
+            x_vel_los.append(x_vel_lo)
+            x_vel_counts.append(x_vel_hi - x_vel_lo + 1)
+            y_vel_los.append(y_vel_lo)
+            y_vel_his.append(y_vel_hi)
+
+    if not x_vel_los:
+        return ((-9999, -9999), -9999, 0)
+
+    counts = np.array(x_vel_counts)
+    starts = np.cumsum(counts) - counts
+    x_vels = np.repeat(np.array(x_vel_los), counts) + (
+        np.arange(counts.sum()) - np.repeat(starts, counts)
+    )
+    y_los = np.repeat(np.array(y_vel_los), counts)
+    y_his = np.repeat(np.array(y_vel_his), counts)
+
+    # Number of hits: the size of the union of y ranges for each x velocity.  Shifting each x velocity's
+    # ranges into its own block lets one sorted sweep (with a running max of range ends) merge them all.
+    order = np.lexsort((y_los, x_vels))
+    block = (x_vels[order] - x_vels.min()) * (y_his.max() - y_los.min() + 2)
+    los, his = y_los[order] + block, y_his[order] + block
+    covered = np.maximum.accumulate(his)
+    prev_covered = np.concatenate(([los[0] - 1], covered[:-1]))
+    num_hits = int(np.maximum(his - np.maximum(los - 1, prev_covered), 0).sum())
+
+    # Highest point is the launcher itself unless fired upwards.  Ties go to the smallest velocities.
+    best_y_vel = int(y_his.max())
+    if best_y_vel > 0:
+        best_vels = (int(x_vels[y_his == best_y_vel].min()), best_y_vel)
+    else:
+        best_x_vel = int(x_vels.min())
+        best_vels = (best_x_vel, int(y_los[x_vels == best_x_vel].min()))
+    return (best_vels, _triangular(max(best_vels[1], 0)), num_hits)
+
+
+class ProbeGrid:
+    """
+    Brute-force simulation of a whole grid of initial velocities at once, for confirming `solve_velocities`.
+
+    Every (x_vel, y_vel) pair is a slot in NumPy arrays which are stepped together.  Probes that have hit the target,
+    or can no longer reach it, are dropped from the arrays being stepped.  Works for any target zone.
+    """
 
-        pattern = re.compile(r"[xy]=(-?\d+)\.\.(-?\d+),?")
-        x, y = re.findall(pattern, input_data)
-        target_zone = TargetZone(int(x[0]), int(x[1]), int(y[0]), int(y[1]))
-        return cls(x_vel, y_vel, target_zone)
+    def __init__(
+        self, target_zone: TargetZone, x_vels: np.ndarray, y_vels: np.ndarray
+    ) -> None:
+        """Grid of probes.
+
+        Parameters
+        ----------
+        target_zone : TargetZone
+            The target, anywhere relative to the launcher.
+        x_vels : np.ndarray
+            Candidate initial x velocities.
+        y_vels : np.ndarray
+            Candidate initial y velocities.  Every pair with `x_vels` is simulated.
+        """
+        self.target_zone = target_zone
+        x_grid, y_grid = np.meshgrid(x_vels, y_vels, indexing="ij")
+        self.x_vels = x_grid.ravel().astype(np.int64)
+        self.y_vels = y_grid.ravel().astype(np.int64)
+
+        self.hits = np.zeros(len(self.x_vels), dtype=bool)
+        self.max_heights = np.zeros(len(self.x_vels), dtype=np.int64)
+        self.num_steps = 0
+
+    def simulate(self) -> None:
+        """Steps every probe until it can never hit the target, or has hit it and reached its highest point."""
+        zone = self.target_zone
+        probe_idx = np.arange(len(self.x_vels))
+        x = np.zeros_like(self.x_vels)
+        y = np.zeros_like(self.y_vels)
+        x_vel = self.x_vels.copy()
+        y_vel = self.y_vels.copy()
+
+        while len(probe_idx):
+            x += x_vel
+            y += y_vel
+            x_vel -= np.sign(x_vel)
+            y_vel -= 1
+            self.num_steps += 1
+            self.max_heights[probe_idx] = np.maximum(self.max_heights[probe_idx], y)
+
+            hit = (
+                (x >= zone.xmin)
+                & (x <= zone.xmax)
+                & (y >= zone.ymin)
+                & (y <= zone.ymax)
+            )
+            self.hits[probe_idx[hit]] = True
+
+            # Out of reach: past the zone in x and not heading back, or below it and falling.
+            missed = (
+                ((x > zone.xmax) & (x_vel >= 0))
+                | ((x < zone.xmin) & (x_vel <= 0))
+                | ((y < zone.ymin) & (y_vel < 0))
+            )
+
+            # Probes that hit keep going only until they stop rising, to get their highest point.
+            keep = np.where(self.hits[probe_idx], y_vel > 0, ~missed)
+            probe_idx, x, y, x_vel, y_vel = (
+                arr[keep] for arr in (probe_idx, x, y, x_vel, y_vel)
+            )
+
+    def summary(self) -> tuple[tuple[int, int], int, int]:
+        """((xvel, yvel), max_y_attained, number_of_vels_that_hit), same as `solve_velocities`."""
+        if not self.hits.any():
+            return ((-9999, -9999), -9999, 0)
+
+        hit_idx = np.flatnonzero(self.hits)
+        # Highest first, then the smallest velocities.
+        best = hit_idx[
+            np.lexsort(
+                (self.y_vels[hit_idx], self.x_vels[hit_idx], -self.max_heights[hit_idx])
+            )[0]
+        ]
+        return (
+            (int(self.x_vels[best]), int(self.y_vels[best])),
+            int(self.max_heights[best]),
+            len(hit_idx),
+        )
+
+    @classmethod
+    def from_bounds(
+        cls,
+        target_zone: TargetZone,
+        x_vel_bounds: tuple[int, int],
+        y_vel_bounds: tuple[int, int],
+    ) -> "ProbeGrid":
+        """Grid of every velocity with x_vel in `x_vel_bounds` and y_vel in `y_vel_bounds` (inclusive)."""
+        return cls(
+            target_zone,
+            np.arange(x_vel_bounds[0], x_vel_bounds[1] + 1),
+            np.arange(y_vel_bounds[0], y_vel_bounds[1] + 1),
+        )
 
 
 # -- Tests --
@@ -158,6 +468,101 @@ def test_examples() -> None:
         ), f"Expected {test[2]} for {test[0]}, {test[1]}"
 
 
+def test_solve_velocities() -> None:
+    test_zone = parse_target_zone("target area: x=20..30, y=-10..-5")
+    assert solve_velocities(test_zone) == ((6, 9), 45, 112)
+
+    def brute_force_hits(
+        target_zone: TargetZone, vel_bound: int, max_steps: int
+    ) -> int:
+        """Simple simulation of every velocity in [-vel_bound, vel_bound]^2."""
+        num_hits = 0
+        for x_vel in range(-vel_bound, vel_bound + 1):
+            for y_vel in range(-vel_bound, vel_bound + 1):
+                x, y, xv, yv = 0, 0, x_vel, y_vel
+                for _ in range(max_steps):
+                    x, y = x + xv, y + yv
+                    xv, yv = xv - (xv > 0) + (xv < 0), yv - 1
+                    if (
+                        target_zone.xmin <= x <= target_zone.xmax
+                        and target_zone.ymin <= y <= target_zone.ymax
+                    ):
+                        num_hits += 1
+                        break
+        return num_hits
+
+    # Zones below, above, behind, and straddling the launcher.
+    for zone in [
+        TargetZone(20, 30, -10, -5),
+        TargetZone(-30, -20, -10, -5),
+        TargetZone(4, 12, 3, 8),
+        TargetZone(-6, 9, -7, -2),
+        TargetZone(-25, -22, -3, 4),
+    ]:
+        assert solve_velocities(zone)[2] == brute_force_hits(zone, 35, 80), zone
+
+    # Hits are counted without being listed, so big zones are cheap.
+    assert solve_velocities(TargetZone(2000, 3000, -1000, -500)) == (
+        (63, 999),
+        499_500,
+        758_501,
+    )
+
+    try:
+        solve_velocities(
+            TargetZone(5, 7, -2, 2)
+        )  # x=6 is a stopping point, y=0 is revisited forever.
+        assert False, "Expected ValueError"
+    except ValueError:
+        pass
+
+
+def test_probe_grid() -> None:
+    test_zone = parse_target_zone("target area: x=20..30, y=-10..-5")
+    grid = ProbeGrid.from_bounds(test_zone, (0, 30), (-10, 10))
+    grid.simulate()
+    assert grid.summary() == ((6, 9), 45, 112)
+
+    # The grid agrees with the step-by-step launcher.
+    for idx in range(0, len(grid.x_vels), 7):
+        probe = ProbeLauncher(int(grid.x_vels[idx]), int(grid.y_vels[idx]), test_zone)
+        probe.step_until_out_of_range()
+        assert probe.has_hit_target() == grid.hits[idx]
+
+    # Zones below, above, behind, and straddling the launcher.
+    for zone in [
+        TargetZone(-30, -20, -10, -5),
+        TargetZone(4, 12, 3, 8),
+        TargetZone(-6, 9, -7, -2),
+        TargetZone(-25, -22, -3, 4),
+    ]:
+        grid = ProbeGrid.from_bounds(zone, (-35, 35), (-35, 35))
+        grid.simulate()
+        assert grid.summary() == solve_velocities(zone), zone
+
+
+def test_history_free_probe() -> None:
+    test_zone = parse_target_zone("target area: x=20..30, y=-10..-5")
+
+    for x_vel in range(0, 31):
+        for y_vel in range(-10, 12):
+            probe = ProbeLauncher(x_vel, y_vel, test_zone)
+            probe.step_until_out_of_range()
+            light_probe = ProbeLauncher(x_vel, y_vel, test_zone, keep_history=False)
+            light_probe.step_until_out_of_range()
+
+            assert light_probe.has_hit_target() == probe.has_hit_target()
+            if probe.has_hit_target():
+                assert light_probe.highest_y_position == probe.highest_y_position
+            assert len(light_probe.positions) == 1
+
+    # A high arc that hits on the way up stops right away, but still knows its highest point.
+    probe = ProbeLauncher(0, 5_000, TargetZone(-1, 1, 4_990, 5_000), keep_history=False)
+    probe.step_until_out_of_range()
+    assert probe.has_hit_target() and probe.highest_y_position == 5_000 * 5_001 // 2
+    assert probe.current_pos == Position(0, 5_000)
+
+
 # test_examples()
 
 if __name__ == "__main__":
@@ -166,50 +571,7 @@ if __name__ == "__main__":
     with open("./aoc/data/a17.csv", "r") as f:
         data = f.read()
 
-    def grid_vels_for_trajectory(
-        input_data: str,
-        xvmin: int = 0,
-        xvmax: int = 300,
-        yvmin: int = -120,
-        yvmax: int = 5_000,
-    ) -> tuple[tuple[int, int], int, int]:
-        """Grid-searches over values for x, y.  Returns x, y such that the max y value is attained and hits the target.
-
-        Parameters
-        ----------
-        xvmin : int, optional
-            Minimum x velocity to begin gridding with, by default 0
-        xvmax : int, optional
-            Maximum x velocity to begin gridding with, by default 20
-        yvmin : int, optional
-            Minimum y velocity to begin gridding with], by default -10
-        yvmax : int, optional
-            Maximum y velocity to begin gridding with, by default 20
-
-        Returns
-        -------
-        tuple[tuple[int, int], int, int]
-            ((xvel, yvel), max_y_attained, number_of_vels_that_hit) which the max y value attained and hits the target.  `number_of_vels_that_hit` is the total number of velocities that hit the target.
-        """
-
-        current_best_vels = (-9999, -9999)
-        current_max_y = -9999
-
-        number_of_vels_that_hit = 0
-
-        for xv in range(xvmin, xvmax + 1):
-            for yv in range(yvmin, yvmax + 1):
-                p = ProbeLauncher.parse_input(input_data, xv, yv)
-                p.step_until_out_of_range()
-                if p.has_hit_target():
-                    number_of_vels_that_hit += 1
-                    if p.highest_y_position > current_max_y:
-                        current_max_y = p.highest_y_position
-                        current_best_vels = (xv, yv)
-
-        return (current_best_vels, current_max_y, number_of_vels_that_hit)
-
-    grid_results = grid_vels_for_trajectory(data)
+    grid_results = solve_velocities(parse_target_zone(data))
 
     solution_a = grid_results[1]
     solution_b = grid_results[2]
@@ -2,10 +2,43 @@
 Code for https://adventofcode.com/2021/day/18
 """
 
-import copy
-import string
 import math
-from itertools import permutations
+import os
+import random
+import re
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice, permutations, product
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+# Token groups: "[", "]", a regular number, a line break, or anything unexpected.
+_TOKEN = re.compile(r"(\[)|(\])|(\d+)|(\n)|([^,\s])")
+_OPEN, _CLOSE, _DIGITS, _NEWLINE = 1, 2, 3, 4
+
+# Magnitude weight of a regular number at [depth, first leaf it fills] in a full depth-4 tree.
+# Bit 3 - k of the leaf index is the k-th step down from the root (0 left, 1 right).
+_SLOT_WEIGHTS = np.array(
+    [
+        [
+            (
+                math.prod(2 if (slot >> (3 - k)) & 1 else 3 for k in range(depth))
+                if depth
+                else 0
+            )
+            for slot in range(16)
+        ]
+        for depth in range(5)
+    ],
+    dtype=np.int64,
+)
+
+# Magnitude weight of each leaf of a full depth-4 tree, largest first.
+_LEAF_WEIGHTS = sorted(
+    (math.prod(path) for path in product((3, 2), repeat=4)), reverse=True
+)
 
 
 class Node:
@@ -34,128 +67,385 @@ class Node:
 
 
 class Nodes:
-    """Class representing a collection of Node objects."""
+    """Class representing a collection of Node objects, stored as two parallel arrays of values and depths."""
 
-    def __init__(self, nodes: list[Node]):
-        self.nodes = nodes
+    def __init__(self, values: Iterable[int], depths: Iterable[int]):
+        self.values = array("q", values)
+        self.depths = array("B", depths)
 
     def __repr__(self) -> str:
         return ", ".join(str(n) for n in self.nodes)
 
-    def explode(self) -> None:
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @property
+    def nodes(self) -> list[Node]:
+        """The elements as (new) Node objects."""
+        return [Node(value, depth) for value, depth in zip(self.values, self.depths)]
+
+    def explode(self) -> bool:
         """
         To explode a pair, the pair's left value is added to the first regular number to the left of the exploding pair (if any), and the pair's right value is added to the first regular number to the right of the exploding pair (if any). Exploding pairs will always consist of two regular numbers. Then, the entire exploding pair is replaced with the regular number 0.
-        """
 
-        new_nodes = copy.deepcopy(self.nodes)
-        for n, node in enumerate(new_nodes):
-            if n == len(new_nodes) - 1:
-                break
+        Explodes the leftmost pair in place.  Returns True if a pair exploded.
+        """
+        values, depths = self.values, self.depths
+        for n in range(len(values) - 1):
             # If the depth is more than 5, explode.
-            # The for-loop will always get the left-most node first,
+            # The loop will always get the left-most node first,
             # check that the node to the right is at the same level.
-            if node.depth >= 5 and new_nodes[n + 1].depth == node.depth:
+            if depths[n] >= 5 and depths[n + 1] == depths[n]:
                 if n != 0:  # if not the leftmost...
-                    new_nodes[n - 1].value += node.value
-                if n != len(new_nodes) - 2:  # if right node is not right-most...
-                    new_nodes[n + 2].value += new_nodes[n + 1].value
+                    values[n - 1] += values[n]
+                if n != len(values) - 2:  # if right node is not right-most...
+                    values[n + 2] += values[n + 1]
 
-                # Add in new 0 node, remove the exploded nodes.
-                new_nodes = (
-                    new_nodes[:n] + [Node(0, node.depth - 1)] + new_nodes[n + 2 :]
-                )
-                break
+                # The pair becomes a 0 node one level up.
+                values[n] = 0
+                depths[n] -= 1
+                del values[n + 1]
+                del depths[n + 1]
+                return True
 
-        self.nodes = new_nodes
+        return False
 
-    def split_node(self) -> None:
-        """To split a regular number, replace it with a pair; the left element of the pair should be the regular number divided by two and rounded down, while the right element of the pair should be the regular number divided by two and rounded up. For example, 10 becomes [5,5], 11 becomes [5,6], 12 becomes [6,6], and so on."""
-        result_nodes = []
+    def split_node(self) -> bool:
+        """To split a regular number, replace it with a pair; the left element of the pair should be the regular number divided by two and rounded down, while the right element of the pair should be the regular number divided by two and rounded up. For example, 10 becomes [5,5], 11 becomes [5,6], 12 becomes [6,6], and so on.
 
-        already_split = False
-        for n, node in enumerate(self.nodes):
+        Splits the leftmost number in place.  Returns True if a number split.
+        """
+        values, depths = self.values, self.depths
+        for n, value in enumerate(values):
+            if value >= 10:
+                values[n] = value // 2
+                values.insert(n + 1, value - value // 2)
+                depths[n] += 1
+                depths.insert(n + 1, depths[n])
+                return True
 
-            if node.value < 10 or already_split:
-                result_nodes.append(node)
+        return False
 
-            else:
-                result_nodes.append(Node(math.floor(node.value / 2), node.depth + 1))
-                result_nodes.append(Node(math.ceil(node.value / 2), node.depth + 1))
-                already_split = True
+    def reduce_nodes(self) -> None:
+        """Fully reduce the number, giving the same result as repeatedly applying the leftmost explode (or, failing that, the leftmost split)."""
+        self._explode_all()
+        self._split_all()
 
-        self.nodes = result_nodes
+    def _explode_all(self) -> None:
+        """Perform every pending explosion in a single left-to-right sweep.
 
-    def reduce_nodes(self) -> None:
-        while True:
-            new_nodes: list[Node] = copy.deepcopy(self.nodes)
-            self.explode()
-            if new_nodes != self.nodes:
-                # If an explosion has occurred, go back to the top.
+        Elements are pushed onto a stack; whenever the top two form a pair at depth 5 or more
+        it explodes, its left value going to the element below it and its right value being
+        carried into the next element read.
+        """
+        values: list[int] = []
+        depths: list[int] = []
+        carry = 0
+        for value, depth in zip(self.values, self.depths):
+            values.append(value + carry)
+            depths.append(depth)
+            carry = 0
+
+            while len(values) > 1 and depths[-1] >= 5 and depths[-1] == depths[-2]:
+                right = values.pop()
+                depth = depths.pop()
+                left = values.pop()
+                depths.pop()
+                if values:
+                    values[-1] += left
+                carry += right
+                values.append(0)
+                depths.append(depth - 1)
+
+        self.values = array("q", values)
+        self.depths = array("B", depths)
+
+    def _split_all(self) -> None:
+        """Perform every pending split, exploding any pair a split creates straight away.
+
+        Assumes nothing is left to explode.  Everything left of the cursor is below 10, so
+        after a split the cursor only has to step back when an explosion pushes the element
+        to its left over 10.
+        """
+        values, depths = self.values, self.depths
+        idx = 0
+        while idx < len(values):
+            value = values[idx]
+            if value < 10:
+                idx += 1
                 continue
-            self.split_node()
-            if new_nodes == self.nodes:
-                break
+
+            left, right = value // 2, value - value // 2
+            if depths[idx] >= 4:
+                # The new pair would be at depth 5, so explode it in place.
+                values[idx] = 0
+                if idx + 1 < len(values):
+                    values[idx + 1] += right
+                if idx > 0:
+                    values[idx - 1] += left
+                    if values[idx - 1] >= 10:
+                        idx -= 1
+            else:
+                values[idx] = left
+                values.insert(idx + 1, right)
+                depths[idx] += 1
+                depths.insert(idx + 1, depths[idx])
 
     def add_new_nodes(self, right_node: "Nodes") -> None:
         """Add a node (on the right) to our existing nodes."""
-        self.nodes = self.nodes + right_node.nodes
-        for node in self.nodes:
-            node.depth += 1
+        self.values.extend(right_node.values)
+        self.depths = array(
+            "B", (depth + 1 for depth in self.depths + right_node.depths)
+        )
 
         self.reduce_nodes()
 
+    def __add__(self, other: "Nodes") -> "Nodes":
+        """The reduced sum of two numbers, leaving both operands untouched."""
+        total = Nodes(
+            self.values + other.values,
+            (depth + 1 for depth in self.depths + other.depths),
+        )
+        total.reduce_nodes()
+        return total
+
     def get_magnitude(self) -> int:
-        _nodes = copy.deepcopy(self.nodes)
-        while len(_nodes) > 1:
+        """Magnitude of the number, in one pass over a stack of (value, depth) pairs.
 
-            if len(_nodes) == 2:
-                _nodes = [
-                    Node(value=3 * _nodes[0].value + 2 * _nodes[1].value, depth=0)
-                ]
-                break
+        Two elements on top of the stack with equal depth are always a pair, so they are
+        collapsed into 3 * left + 2 * right one level up.
+        """
+        values: list[int] = []
+        depths: list[int] = []
+        for value, depth in zip(self.values, self.depths):
+            while depths and depths[-1] == depth:
+                value = 3 * values.pop() + 2 * value
+                depths.pop()
+                depth -= 1
+            values.append(value)
+            depths.append(depth)
+
+        return values[0]
 
-            new_nodes = []
-            for idx in range(len(_nodes) - 1):
-                if _nodes[idx].depth == _nodes[idx + 1].depth:
-                    new_node_val = 3 * _nodes[idx].value + 2 * _nodes[idx + 1].value
+    @classmethod
+    def parse_data(cls, data: str) -> "Nodes":
+        """Parse a single snailfish number, e.g. "[[1,2],3]"."""
+        numbers = cls.parse_homework(data)
+        if len(numbers) != 1:
+            raise ValueError(f"Expected one snailfish number, got {len(numbers)}.")
+        return numbers[0]
+
+    @classmethod
+    def parse_homework(cls, text: str) -> list["Nodes"]:
+        """Parse a whole homework file (one snailfish number per line) in a single pass.
+
+        Each number keeps only its regular numbers and their depths; commas carry no information
+        and are skipped by the tokenizer.
+        """
+        numbers = []
+        values: list[int] = []
+        depths: list[int] = []
+        depth = 0
+        for match in _TOKEN.finditer(text):
+            kind = match.lastindex
+            if kind == _OPEN:
+                depth += 1
+            elif kind == _CLOSE:
+                depth -= 1
+            elif kind == _DIGITS:
+                values.append(int(match.group(_DIGITS)))
+                depths.append(depth)
+            elif kind == _NEWLINE:
+                if depth:
+                    raise ValueError("Unbalanced brackets in snailfish number.")
+                if values:
+                    numbers.append(cls(values, depths))
+                    values, depths = [], []
+            else:
+                raise ValueError(
+                    f"Unexpected character {match.group()!r} in snailfish number."
+                )
+
+        if depth:
+            raise ValueError("Unbalanced brackets in snailfish number.")
+        if values:
+            numbers.append(cls(values, depths))
+
+        return numbers
+
+
+class SnailfishBatch:
+    """Many snailfish additions reduced at once, one sum per row of a (batch, 32) value/depth matrix.
+
+    Rows hold the regular numbers of a sum left to right; unused cells have depth 0.  A sum of two
+    reduced numbers has at most 32 regular numbers before reduction and 16 after its explosions,
+    so the width never needs to grow.
+    """
 
-                    new_nodes = (
-                        _nodes[:idx]
-                        + [Node(new_node_val, depth=_nodes[idx].depth - 1)]
-                        + _nodes[idx + 2 :]
-                    )
-                    _nodes = new_nodes
-                    break
+    WIDTH = 32
 
-        return _nodes[0].value
+    def __init__(self, values: np.ndarray, depths: np.ndarray):
+        self.values = values.astype(np.int64)
+        self.depths = depths.astype(np.int8)
+
+    def __len__(self) -> int:
+        return len(self.values)
 
     @classmethod
-    def parse_data(cls, data: str) -> "Nodes":
-        """Pretty gnarly way to do this.  I'll look back and see if there's something nicer with some kind of AST algs.  Right now,
-        it just sort of goes over the symbols and for each one makes some alteration to depth (depth in the list), position (left or right),
-        and the current digit we're considering.  Not a good parser."""
-
-        nodes = []
-        current_depth = 0
-        current_digit = ""
-        for symbol in data:
-            if symbol == "[":
-                current_depth += 1
-            elif symbol in string.digits:
-                current_digit += symbol
-            elif symbol == ",":
-                if current_digit:
-                    nodes.append(Node(int(current_digit), current_depth))
-                    current_digit = ""
-            elif symbol == "]":
-                if current_digit:
-                    nodes.append(Node(int(current_digit), current_depth))
-                    current_digit = ""
-                current_depth -= 1
-            else:
-                print(f"Don't know what to do with {symbol} .")
+    def from_sums(
+        cls, numbers: list[Nodes], pairs: Iterable[tuple[int, int]]
+    ) -> "SnailfishBatch":
+        """Packs the (not yet reduced) sums `numbers[left] + numbers[right]` for each pair.
+
+        The numbers must already be reduced, so each has at most 16 regular numbers.
+        """
+        half = cls.WIDTH // 2
+        if any(len(n) > half for n in numbers):
+            raise ValueError(
+                f"Numbers must be reduced (at most {half} regular numbers)."
+            )
+
+        packed_values = np.zeros((len(numbers), half), dtype=np.int64)
+        packed_depths = np.zeros((len(numbers), half), dtype=np.int8)
+        lengths = np.array([len(n) for n in numbers], dtype=np.int64)
+        for idx, n in enumerate(numbers):
+            packed_values[idx, : len(n)] = n.values
+            packed_depths[idx, : len(n)] = n.depths
+
+        left, right = np.array(list(pairs), dtype=np.int64).reshape(-1, 2).T
+        cols = np.arange(cls.WIDTH)
+        from_left = cols < lengths[left, None]
+        left_cols = np.minimum(cols, half - 1)[None, :].repeat(len(left), axis=0)
+        right_cols = np.clip(cols - lengths[left, None], 0, half - 1)
+
+        values = np.where(
+            from_left,
+            np.take_along_axis(packed_values[left], left_cols, axis=1),
+            np.take_along_axis(packed_values[right], right_cols, axis=1),
+        )
+        depths = np.where(
+            from_left,
+            np.take_along_axis(packed_depths[left], left_cols, axis=1),
+            np.take_along_axis(packed_depths[right], right_cols, axis=1),
+        )
+        in_sum = cols < (lengths[left] + lengths[right])[:, None]
+
+        # Adding wraps both operands in a new pair, one level deeper.
+        return cls(np.where(in_sum, values, 0), np.where(in_sum, depths + 1, 0))
+
+    def to_nodes(self, row: int) -> Nodes:
+        in_row = self.depths[row] > 0
+        return Nodes(
+            self.values[row, in_row].tolist(), self.depths[row, in_row].tolist()
+        )
+
+    def reduce(self) -> None:
+        """Reduces every row, with the same result as `Nodes.reduce_nodes`."""
+        self._explode_all()
+        self._split_all()
+
+    def _explode_all(self) -> None:
+        """Explodes every depth-5 pair of every row at once.
 
-        return Nodes(nodes)
+        Sums of reduced numbers only have depth-5 pairs of regular numbers, so counting depth-5
+        cells along a row tells left and right elements apart.  Exploding a run of adjacent pairs
+        left to right sends each right value into the next pair, whose left value then lands in
+        the 0 the previous pair left behind; the masks below apply all of that in one step.
+        """
+        values, depths = self.values, self.depths
+        if (depths > 5).any():
+            raise ValueError("Rows must be sums of reduced numbers (depth at most 5).")
+
+        deepest = depths == 5
+        left = deepest & (np.cumsum(deepest, axis=1) % 2 == 1)
+        right = deepest & ~left
+
+        prev_right = np.zeros_like(right)
+        prev_right[:, 1:] = right[:, :-1]
+        next_left = np.zeros_like(left)
+        next_left[:, :-1] = left[:, 1:]
+        next_used = np.zeros_like(right)
+        next_used[:, :-1] = depths[:, 1:] > 0
+
+        added = np.zeros_like(values)
+        # Left values go to the element on the left, or the 0 of the pair exploded just before.
+        added[:, :-1] += np.where(left & ~prev_right, values, 0)[:, 1:]
+        added[:, :-2] += np.where(left & prev_right, values, 0)[:, 2:]
+        # Right values go to the element on the right, or back to this pair's 0 via the next pair.
+        added[:, 1:] += np.where(right & next_used & ~next_left, values, 0)[:, :-1]
+        added[:, :-1] += np.where(right & next_left, values, 0)[:, 1:]
+
+        values = np.where(left, 0, values) + added
+        depths = np.where(left, 4, depths)
+
+        # Drop the right elements, shuffling the rest of each row left.
+        keep = (depths > 0) & ~right
+        order = np.argsort(~keep, axis=1, kind="stable")
+        keep = np.take_along_axis(keep, order, axis=1)
+        self.values = np.where(keep, np.take_along_axis(values, order, axis=1), 0)
+        self.depths = np.where(
+            keep, np.take_along_axis(depths, order, axis=1), 0
+        ).astype(np.int8)
+
+    def _split_all(self) -> None:
+        """Splits the leftmost number of 10 or more in every row that has one, until none do.
+
+        As in `Nodes._split_all`, a split at depth 4 explodes straight away.  Each pass does one
+        split per row, so the number of passes is the most splits any one row needs.
+        """
+        values, depths = self.values, self.depths
+        cols = np.arange(self.WIDTH)
+        # Only rows that split on the last pass can need another one.
+        rows = np.arange(len(values))
+        while True:
+            big = values[rows] >= 10
+            needs_split = big.any(axis=1)
+            rows = rows[needs_split]
+            if not len(rows):
+                break
+
+            pos = big[needs_split].argmax(axis=1)
+            value = values[rows, pos]
+            low, high = value // 2, value - value // 2
+            deep = depths[rows, pos] >= 4
+
+            # Splits that would make a depth-5 pair explode in place.
+            d_rows, d_pos = rows[deep], pos[deep]
+            values[d_rows, d_pos] = 0
+            has_prev = d_pos > 0
+            values[d_rows[has_prev], d_pos[has_prev] - 1] += low[deep][has_prev]
+            has_next = depths[d_rows, np.minimum(d_pos + 1, self.WIDTH - 1)] > 0
+            has_next &= d_pos + 1 < self.WIDTH
+            values[d_rows[has_next], d_pos[has_next] + 1] += high[deep][has_next]
+
+            # Other splits insert a new element, shifting the rest of the row right.
+            s_rows, s_pos = rows[~deep], pos[~deep]
+            if len(s_rows):
+                src = cols - (cols > s_pos[:, None])
+                s_values = np.take_along_axis(values[s_rows], src, axis=1)
+                s_depths = np.take_along_axis(depths[s_rows], src, axis=1)
+                idx = np.arange(len(s_rows))
+                s_values[idx, s_pos] = low[~deep]
+                s_values[idx, s_pos + 1] = high[~deep]
+                s_depths[idx, s_pos] += 1
+                s_depths[idx, s_pos + 1] = s_depths[idx, s_pos]
+                values[s_rows] = s_values
+                depths[s_rows] = s_depths
+
+    def magnitudes(self) -> np.ndarray:
+        """Magnitude of every (reduced) row.
+
+        A regular number at depth d fills 2 ** (4 - d) consecutive leaves of a full depth-4
+        tree, so the leaves filled before it give its path from the root, and so its weight.
+        """
+        in_row = self.depths > 0
+        if (self.depths > 4).any():
+            raise ValueError("Rows must be reduced (depth at most 4).")
+
+        width = np.where(in_row, 2 ** (4 - self.depths.astype(np.int64)), 0)
+        slots = np.cumsum(width, axis=1) - width
+        weights = _SLOT_WEIGHTS[self.depths, np.minimum(slots, 15)]
+        return (self.values * weights).sum(axis=1)
 
 
 # -- Helper Functions --
@@ -163,30 +453,200 @@ class Nodes:
 
 def get_sum_and_magnitude_for_input(data: list[str]) -> int:
     """Takes input data, sums all values, returns the magnitude."""
-    n = Nodes.parse_data(data[0])
-    for _n in data[1:]:
-        n.add_new_nodes(Nodes.parse_data(_n))
+    numbers = Nodes.parse_homework("\n".join(data))
+    n = numbers[0]
+    for _n in numbers[1:]:
+        n.add_new_nodes(_n)
     n.reduce_nodes()
     return n.get_magnitude()
 
 
 def all_magnitudes_of_two_summands(data: list[str]) -> int:
-    """Brute force, sums all pairs together (non-commutative!) and returns a list of magnitudes."""
+    """Largest magnitude from adding any two (different) numbers in the data, in either order."""
+    magnitude, _ = largest_pair_magnitude(
+        Nodes.parse_homework("\n".join(data)), max_workers=1
+    )
+    return magnitude
+
+
+def magnitude_upper_bound(total: int) -> int:
+    """Upper bound on the magnitude of any reduced number whose regular numbers add up to at most `total`.
+
+    A reduced number has no value above 9 and no leaf deeper than 4, and a shallower leaf is worth
+    less than the pair it could be split into, so the bound fills the 16 leaves of a full depth-4
+    tree with 9s, most valuable position first.  Reduction never increases the sum of the values
+    (exploding at the edges drops them), so for a sum of two numbers `total` is the sum of both.
+    """
+    bound = 0
+    for weight in _LEAF_WEIGHTS:
+        value = min(9, total)
+        bound += value * weight
+        total -= value
+        if total <= 0:
+            break
+    return bound
+
+
+def largest_pair_magnitude(
+    numbers: list[Nodes],
+    pairs_per_task: int = 256,
+    max_workers: Optional[int] = None,
+) -> tuple[int, tuple[int, int]]:
+    """Largest magnitude of `numbers[i] + numbers[j]` over all ordered pairs i != j.
+
+    Pairs are tried in order of decreasing `magnitude_upper_bound`, so once the bound of the next
+    pair can't beat the best magnitude found so far the search stops.  Batches of pairs are spread
+    across worker processes; each one only sends back its best magnitude and pair.
+
+    Parameters
+    ----------
+    numbers : list[Nodes]
+        The homework numbers; they are not modified.
+    pairs_per_task : int, optional
+        Number of pairs sent to a worker at a time, by default 256
+    max_workers : Optional[int], optional
+        Number of worker processes, by default `os.cpu_count()`.  With 1 the search runs in this
+        process.
+
+    Returns
+    -------
+    tuple[int, tuple[int, int]]
+        The largest magnitude and a pair of indices (left, right) giving it.
+    """
+    if len(numbers) < 2:
+        raise ValueError("Need at least two numbers to add.")
+
+    candidates = _candidate_pairs([sum(n.values) for n in numbers])
+    tasks = iter(lambda: list(islice(candidates, pairs_per_task)), [])
+
+    best, best_pair = -1, (-1, -1)
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1:
+        for task in tasks:
+            if task[0][0] <= best:
+                break
+            best, best_pair = _best_pair_in_task(numbers, task, best, best_pair)
+        return best, best_pair
+
+    # The numbers go to each worker once, when it starts; tasks only carry indices.
+    # Tasks go out in bound order with a bounded number in flight, so each one is submitted with
+    # a recent best and later tasks can be dropped without ever being sent.  Each future is kept
+    # with its task's leading bound: a queued task can only be cancelled once that can't beat
+    # the best.
+    pending: deque[tuple[int, Future]] = deque()
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_init_pair_worker,
+        initargs=(numbers,),
+    ) as executor:
+        for task in tasks:
+            if task[0][0] <= best:
+                break
+            pending.append(
+                (
+                    task[0][0],
+                    executor.submit(_best_pair_in_worker_task, task, best, best_pair),
+                )
+            )
+            if len(pending) >= 2 * max_workers:
+                magnitude, pair = pending.popleft()[1].result()
+                if magnitude > best:
+                    best, best_pair = magnitude, pair
+
+        for bound, future in pending:
+            if bound <= best and future.cancel():
+                continue
+            magnitude, pair = future.result()
+            if magnitude > best:
+                best, best_pair = magnitude, pair
+
+    return best, best_pair
+
+
+def pair_magnitudes(numbers: list[Nodes], batch_size: int = 4096) -> np.ndarray:
+    """Magnitudes of `numbers[i] + numbers[j]` for every ordered pair, computed with `SnailfishBatch`.
+
+    Entry [i, j] is the magnitude of the sum with numbers[i] on the left; the diagonal is -1.
+    """
+    magnitudes = np.full((len(numbers), len(numbers)), -1, dtype=np.int64)
+    pairs = list(permutations(range(len(numbers)), 2))
+    for idx in range(0, len(pairs), batch_size):
+        chunk = pairs[idx : idx + batch_size]
+        batch = SnailfishBatch.from_sums(numbers, chunk)
+        batch.reduce()
+        left, right = np.array(chunk).T
+        magnitudes[left, right] = batch.magnitudes()
+
+    return magnitudes
+
+
+def _candidate_pairs(totals: list[int]) -> Iterator[tuple[int, int, int]]:
+    """Yields (bound, left, right) for every ordered pair of indices, in order of decreasing bound.
+
+    The bound only depends on the sum of the two numbers' values, so indices are grouped by their
+    value total and pairs are produced one pair total at a time, largest first.
+    """
+    by_total: dict[int, list[int]] = {}
+    for idx, total in enumerate(totals):
+        by_total.setdefault(total, []).append(idx)
+
+    pair_totals = sorted({a + b for a in by_total for b in by_total}, reverse=True)
+    for pair_total in pair_totals:
+        bound = magnitude_upper_bound(pair_total)
+        for left_total, lefts in by_total.items():
+            for left in lefts:
+                for right in by_total.get(pair_total - left_total, []):
+                    if left != right:
+                        yield bound, left, right
+
+
+# Homework numbers for the current worker process, set once by `_init_pair_worker`.
+_PAIR_NUMBERS: list[Nodes] = []
+
+
+def _init_pair_worker(numbers: list[Nodes]) -> None:
+    global _PAIR_NUMBERS
+    _PAIR_NUMBERS = numbers
+
 
-    nodes = [Nodes.parse_data(data[i]) for i in range(len(data))]
-    magnitudes = []
-    for idxs in list(permutations(range(len(nodes)), 2)):
-        nn = copy.deepcopy(nodes[idxs[0]])
-        nn1 = copy.deepcopy(nodes[idxs[1]])
-        nn.add_new_nodes(nn1)
+def _best_pair_in_worker_task(
+    task: list[tuple[int, int, int]], best: int, best_pair: tuple[int, int]
+) -> tuple[int, tuple[int, int]]:
+    """Worker: `_best_pair_in_task` over the numbers this worker was started with."""
+    return _best_pair_in_task(_PAIR_NUMBERS, task, best, best_pair)
 
-        magnitudes.append(nn.get_magnitude())
 
-    return max(magnitudes)
+def _best_pair_in_task(
+    numbers: list[Nodes],
+    task: list[tuple[int, int, int]],
+    best: int,
+    best_pair: tuple[int, int],
+) -> tuple[int, tuple[int, int]]:
+    """Worker: adds the (bound, left, right) pairs in `task` until a bound can't beat `best`."""
+    for bound, left, right in task:
+        if bound <= best:
+            break
+        magnitude = (numbers[left] + numbers[right]).get_magnitude()
+        if magnitude > best:
+            best, best_pair = magnitude, (left, right)
+    return best, best_pair
 
 
 # -- Tests --
 
+TEST_HOMEWORK = [
+    "[[[0,[5,8]],[[1,7],[9,6]]],[[4,[1,2]],[[1,4],2]]]",
+    "[[[5,[2,8]],4],[5,[[9,9],0]]]",
+    "[6,[[[6,2],[5,6]],[[7,6],[4,7]]]]",
+    "[[[6,[0,7]],[0,9]],[4,[9,[9,0]]]]",
+    "[[[7,[6,4]],[3,[1,3]]],[[[5,5],1],9]]",
+    "[[6,[[7,3],[3,2]]],[[[3,8],[5,7]],4]]",
+    "[[[[5,4],[7,7]],8],[[8,3],8]]",
+    "[[9,3],[[9,9],[6,[4,9]]]]",
+    "[[2,[[7,7],7]],[[5,8],[[9,3],[0,2]]]]",
+    "[[[[5,2],5],[8,[3,7]]],[[5,[7,5]],[4,4]]]",
+]
+
 
 def test_explode_once() -> None:
     """Tests related to exploding once."""
@@ -346,6 +806,101 @@ def test_magnitude_of_two_summands() -> None:
         assert value == test[1], f"Expected {test[1]}, got { value }."
 
 
+def test_reduce_matches_stepwise() -> None:
+    """Tests that the single-sweep reduction matches applying explode/split one at a time."""
+    for left, right in permutations(TEST_HOMEWORK[:6], 2):
+        fast = Nodes.parse_data(left)
+        fast.add_new_nodes(Nodes.parse_data(right))
+
+        slow = Nodes.parse_data(f"[{left},{right}]")
+        while slow.explode() or slow.split_node():
+            pass
+
+        assert fast.values == slow.values and fast.depths == slow.depths
+
+
+def test_parse_homework() -> None:
+    """Tests related to parsing a whole homework file."""
+    numbers = Nodes.parse_homework("[[1,2],3]\n\n[14,[5,[6,7]]]\n")
+
+    assert [list(n.values) for n in numbers] == [[1, 2, 3], [14, 5, 6, 7]]
+    assert [list(n.depths) for n in numbers] == [[2, 2, 1], [1, 2, 3, 3]]
+
+    for bad in ("[1,2", "[1,x]", "[1,2]\n[3,4]"):
+        try:
+            Nodes.parse_data(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"Expected ValueError for {bad!r}.")
+
+
+def test_largest_pair_magnitude() -> None:
+    """Tests the pruned pair search against trying every pair."""
+    numbers = Nodes.parse_homework("\n".join(TEST_HOMEWORK))
+    magnitudes = {
+        (i, j): (numbers[i] + numbers[j]).get_magnitude()
+        for i, j in permutations(range(len(numbers)), 2)
+    }
+
+    for (i, j), magnitude in magnitudes.items():
+        total = sum(numbers[i].values) + sum(numbers[j].values)
+        assert magnitude <= magnitude_upper_bound(total)
+
+    # Candidates cover every ordered pair once, best bound first.
+    candidates = list(_candidate_pairs([sum(n.values) for n in numbers]))
+    assert sorted((i, j) for _, i, j in candidates) == sorted(magnitudes)
+    bounds = [bound for bound, _, _ in candidates]
+    assert bounds == sorted(bounds, reverse=True)
+
+    best, pair = largest_pair_magnitude(numbers, pairs_per_task=8, max_workers=1)
+    assert best == max(magnitudes.values()) == 3993
+    assert magnitudes[pair] == best
+
+
+def test_largest_pair_magnitude_parallel() -> None:
+    """Tests the pruned pair search across worker processes.
+
+    Not part of `run_tests`: a process pool can't be started while this module is still importing.
+    """
+    numbers = Nodes.parse_homework("\n".join(TEST_HOMEWORK))
+
+    best, pair = largest_pair_magnitude(numbers, pairs_per_task=8, max_workers=2)
+    assert best == 3993
+    assert (numbers[pair[0]] + numbers[pair[1]]).get_magnitude() == best
+
+    # Full-depth numbers whose bounds all tie, so nothing can be pruned and every queued task
+    # has to be collected.
+    rng = random.Random(18)
+    numbers = [
+        Nodes([rng.randint(5, 9) for _ in range(16)], [4] * 16) for _ in range(12)
+    ]
+    expected = max(
+        (numbers[i] + numbers[j]).get_magnitude()
+        for i, j in permutations(range(len(numbers)), 2)
+    )
+    for _ in range(5):
+        best, pair = largest_pair_magnitude(numbers, pairs_per_task=1, max_workers=4)
+        assert best == expected
+        assert (numbers[pair[0]] + numbers[pair[1]]).get_magnitude() == best
+
+
+def test_snailfish_batch() -> None:
+    """Tests the batched reduction against adding the numbers one pair at a time."""
+    numbers = Nodes.parse_homework("\n".join(TEST_HOMEWORK))
+    pairs = list(permutations(range(len(numbers)), 2))
+
+    batch = SnailfishBatch.from_sums(numbers, pairs)
+    batch.reduce()
+    magnitudes = batch.magnitudes()
+    for row, (i, j) in enumerate(pairs):
+        expected = numbers[i] + numbers[j]
+        reduced = batch.to_nodes(row)
+        assert reduced.values == expected.values and reduced.depths == expected.depths
+        assert magnitudes[row] == expected.get_magnitude()
+
+    assert pair_magnitudes(numbers, batch_size=7).max() == 3993
+
+
 def run_tests() -> None:
     test_explode_once()
     test_split_once()
@@ -354,6 +909,10 @@ def run_tests() -> None:
     test_magnitude()
     test_misc_input()
     test_magnitude_of_two_summands()
+    test_reduce_matches_stepwise()
+    test_parse_homework()
+    test_largest_pair_magnitude()
+    test_snailfish_batch()
 
 
 run_tests()
@@ -367,6 +926,6 @@ if __name__ == "__main__":
         data = f.read().splitlines()
 
     solution_a = get_sum_and_magnitude_for_input(data)
-    solution_b = all_magnitudes_of_two_summands(data)
+    solution_b, _ = largest_pair_magnitude(Nodes.parse_homework("\n".join(data)))
 
     print(f"AOC18a: {solution_a}\nAOC18b: {solution_b}")